@@ -0,0 +1,51 @@
+"""Задержка одного опроса: requests.get против пула keep-alive сессии.
+
+Запуск: python benchmarks/bench_session.py [число опросов]
+"""
+import statistics
+import sys
+import time
+
+import requests
+
+from servers import start_server
+
+import homework
+
+POLLS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+HEADERS = {'Authorization': 'OAuth benchmark'}
+
+
+def measure(session):
+    """Задержки опросов в миллисекундах."""
+    latencies = []
+    for _ in range(POLLS):
+        started = time.perf_counter()
+        homework.request_api(0, HEADERS, session)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def report(name, latencies):
+    """Печать медианы и 99-го перцентиля."""
+    latencies.sort()
+    print(
+        f'{name:>16}: p50 {statistics.median(latencies):7.2f} мс, '
+        f'p99 {latencies[int(len(latencies) * 0.99) - 1]:7.2f} мс'
+    )
+
+
+def main():
+    """Сравнение на локальной HTTPS-заглушке."""
+    server, url = start_server()
+    homework.ENDPOINT = url
+    try:
+        report('requests.get', measure(requests))
+        with homework.make_session(1) as session:
+            report('Session', measure(session))
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
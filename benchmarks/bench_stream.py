@@ -0,0 +1,79 @@
+"""Разбор большой истории работ: response.json() против потокового.
+
+Запуск: python benchmarks/bench_stream.py [число работ ...]
+
+Для каждого размера истории ответ API с from_date=0 разбирается целиком
+(request_api и diff_homeworks) и потоково (stream_api и iter_changes);
+печатаются время и пик памяти Python по tracemalloc. В обоих случаях
+строится индекс статусов, как при первой загрузке истории.
+"""
+import sys
+import time
+import tracemalloc
+
+import requests
+
+from servers import HistoryHandler, start_server
+
+import homework
+
+SIZES = [int(size) for size in sys.argv[1:]] or [10000, 50000, 100000]
+HEADERS = {'Authorization': 'OAuth benchmark'}
+
+
+def parse_whole(session):
+    """Индекс статусов по ответу, прочитанному целиком."""
+    statuses = {}
+    response = homework.request_api(0, HEADERS, session)
+    for change in homework.diff_homeworks(
+        statuses, homework.check_response(response)
+    ):
+        statuses[homework.homework_key(change)] = change['status']
+    return statuses
+
+
+def parse_stream(session):
+    """Индекс статусов по ответу, читаемому потоком."""
+    statuses = {}
+    for change in homework.iter_changes(
+        statuses, homework.stream_api(0, HEADERS, {}, session)
+    ):
+        statuses[homework.homework_key(change)] = change['status']
+    return statuses
+
+
+def measure(parse, session):
+    """Время в секундах и пик памяти в МБ."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    statuses = parse(session)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(statuses), elapsed, peak / 2 ** 20
+
+
+def main():
+    """Сравнение на локальной HTTP-заглушке."""
+    for size in SIZES:
+        server, url = start_server(
+            HistoryHandler, https=False, homeworks=size
+        )
+        homework.ENDPOINT = url
+        try:
+            with requests.Session() as session:
+                parse_whole(session)
+                for name, parse in (
+                    ('json', parse_whole), ('stream', parse_stream)
+                ):
+                    count, elapsed, peak = measure(parse, session)
+                    print(
+                        f'{size:>7} работ, {name:>6}: {elapsed:6.2f} с, '
+                        f'пик памяти {peak:7.1f} МБ, статусов {count}'
+                    )
+        finally:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
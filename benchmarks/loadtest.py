@@ -0,0 +1,145 @@
+"""Нагрузочный тест цикла опроса на локальных заглушках.
+
+Запуск: python benchmarks/loadtest.py --tenants 10 1000 10000
+
+Для каждого числа подписчиков выполняется несколько проходов опроса
+через PollingEngine и Outbox; печатаются пропускная способность,
+p50/p99 задержки запроса к API, процессорное время и пиковый RSS.
+"""
+import argparse
+import asyncio
+import logging
+import resource
+import statistics
+import threading
+import time
+
+import telegram
+
+from servers import PracticumHandler, TelegramHandler, start_server
+
+import homework
+
+TELEGRAM_TOKEN = '123456:benchmark'
+
+
+def parse_args():
+    """Параметры нагрузки."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--tenants', type=int, nargs='+',
+                        default=[10, 1000, 10000])
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=homework.POLL_WORKERS)
+    parser.add_argument('--mode', choices=homework.ENGINES, default='threads')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='задержка ответа API, с')
+    parser.add_argument('--error-rate', type=float, default=0.001,
+                        help='доля ответов API с кодом 500')
+    parser.add_argument('--api-rate', type=float, default=10 ** 6,
+                        help='лимит запросов к API в секунду')
+    parser.add_argument('--churn', type=float, default=0.05,
+                        help='доля ответов API с новым статусом')
+    return parser.parse_args()
+
+
+def timed(get, latencies, lock):
+    """Обёртка session.get, записывающая задержку запроса."""
+    if asyncio.iscoroutinefunction(get):
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await get(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - started)
+        return wrapper
+
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return get(*args, **kwargs)
+        finally:
+            with lock:
+                latencies.append(time.perf_counter() - started)
+    return wrapper
+
+
+def percentile(values, share):
+    """Перцентиль отсортированного списка."""
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def run_engine(engine, cycles):
+    """Проходы опроса всех подписчиков выбранным движком."""
+    if isinstance(engine, homework.AsyncPollingEngine):
+        async def run():
+            engine.semaphore = homework.asyncio.Semaphore(engine.workers)
+            with homework.ThreadPoolExecutor(
+                min(engine.workers, homework.POLL_WORKERS)
+            ) as executor:
+                engine.executor = executor
+                for _ in range(cycles):
+                    await engine.run_cycle_async()
+            await engine.session.close()
+        homework.asyncio.run(run())
+        return
+    with homework.ThreadPoolExecutor(engine.workers) as executor:
+        for _ in range(cycles):
+            engine.run_cycle(executor)
+
+
+def run(count, args, telegram_url):
+    """Нагрузка на count подписчиков, возвращает строку отчёта."""
+    bot = telegram.Bot(
+        TELEGRAM_TOKEN, base_url=telegram_url,
+        request=homework.Request(con_pool_size=8)
+    )
+    outbox = homework.Outbox(bot, global_rate=10 ** 6, chat_rate=10 ** 6)
+    outbox.start()
+    tenants = [
+        homework.Tenant(f'token{number}', number) for number in range(count)
+    ]
+    latencies, lock = [], threading.Lock()
+    session = homework.ENGINES[args.mode].make_client(args.workers)
+    session.get = timed(session.get, latencies, lock)
+    engine = homework.ENGINES[args.mode](
+        bot, tenants, args.workers, session=session, outbox=outbox,
+        limiter=homework.AdaptiveRateLimiter(args.api_rate)
+    )
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    run_engine(engine, args.cycles)
+    elapsed = time.perf_counter() - started
+    outbox.stop()
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (after.ru_utime - usage.ru_utime) + (after.ru_stime - usage.ru_stime)
+    latencies.sort()
+    return (
+        f'{count:>6} подписчиков: {count * args.cycles / elapsed:8.0f} '
+        f'опросов/с, p50 {statistics.median(latencies) * 1000:6.1f} мс, '
+        f'p99 {percentile(latencies, 0.99) * 1000:6.1f} мс, '
+        f'CPU {cpu:6.2f} с, RSS {after.ru_maxrss / 1024:6.1f} МБ'
+    )
+
+
+def main():
+    """Запуск заглушек и нагрузки по всем размерам парка."""
+    args = parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+    practicum, homework.ENDPOINT = start_server(
+        PracticumHandler, https=False, latency=args.latency,
+        error_rate=args.error_rate, churn=args.churn
+    )
+    telegram_server, telegram_url = start_server(
+        TelegramHandler, https=False, path='/bot'
+    )
+    homework.backoff_delay = lambda attempt: 0
+    try:
+        for count in args.tenants:
+            print(run(count, args, telegram_url), flush=True)
+    finally:
+        practicum.shutdown()
+        telegram_server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
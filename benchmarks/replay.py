@@ -0,0 +1,226 @@
+"""Воспроизведение записанного трафика через цикл опроса.
+
+Запуск: python benchmarks/replay.py traffic.jsonl.gz [--speed 1000]
+        [--output notifications.txt] [--profile]
+
+Журнал пишет бот с переменной окружения RECORD_FILE. Ответы API
+отдаются подписчикам в записанном порядке, не раньше момента записи.
+По умолчанию бот работает на модельных часах homework.SimulatedClock:
+паузы не ждут, и сутки трафика воспроизводятся за время работы
+процессора. С --speed время идёт в заданное число раз быстрее настоящего.
+Отправленные сообщения печатаются сводкой и сохраняются в --output
+для сравнения между сборками.
+"""
+import argparse
+import cProfile
+import gzip
+import json
+import logging
+import pstats
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+import requests
+
+import servers  # noqa: F401  добавляет корень репозитория в sys.path
+
+import homework
+
+
+def parse_args():
+    """Параметры воспроизведения."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('log', help='журнал трафика, записанный ботом')
+    parser.add_argument('--speed', type=float,
+                        help='во сколько раз время идёт быстрее настоящего; '
+                             'без параметра — модельное время')
+    parser.add_argument('--output', help='файл для отправленных сообщений')
+    parser.add_argument('--profile', action='store_true',
+                        help='профилировать цикл опроса')
+    return parser.parse_args()
+
+
+class ScaledClock(homework.Clock):
+    """Часы бота, идущие в speed раз быстрее настоящих."""
+
+    def __init__(self, speed, origin):
+        """Отсчёт начинается с момента origin журнала."""
+        self.speed = speed
+        self.origin = origin
+        self.started = time.monotonic()
+
+    def monotonic(self):
+        """Ускоренное монотонное время."""
+        return (time.monotonic() - self.started) * self.speed
+
+    def time(self):
+        """Ускоренное время журнала."""
+        return self.origin + self.monotonic()
+
+    def sleep(self, seconds):
+        """Пауза, сокращённая в speed раз."""
+        time.sleep(max(0, seconds) / self.speed)
+
+    def timeout(self, seconds):
+        """Ожидание очереди, сокращённое в speed раз."""
+        return seconds if seconds is None else seconds / self.speed
+
+
+class ReplayResponse:
+    """Записанный ответ API."""
+
+    def __init__(self, status_code, body, retry_after=None):
+        """Ответ с кодом, телом и заголовком Retry-After."""
+        self.status_code = status_code
+        self.body = body
+        self.headers = {}
+        if retry_after is not None:
+            self.headers['Retry-After'] = retry_after
+
+    def json(self):
+        """Тело ответа."""
+        if self.body is None:
+            raise ValueError('Тело ответа не записано')
+        return self.body
+
+    def iter_content(self, chunk_size=1):
+        """Тело ответа частями."""
+        body = json.dumps(self.json()).encode()
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+
+    def __enter__(self):
+        """Ответ как контекстный менеджер."""
+        return self
+
+    def __exit__(self, *args):
+        """Закрывать нечего."""
+
+
+class ReplaySession:
+    """Клиент API, отдающий записанные ответы.
+
+    Каждому токену ответы отдаются по порядку и не раньше момента записи;
+    если очередной ответ ещё не наступил, API отвечает без изменений.
+    """
+
+    def __init__(self, events, clock):
+        """События api журнала группируются по токенам."""
+        self.clock = clock
+        self.responses = {}
+        for event in events:
+            self.responses.setdefault(event['token'], deque()).append(event)
+        self.replayed = 0
+        self.lock = threading.Lock()
+
+    def next_event(self, token):
+        """Очередной наступивший ответ токена либо None."""
+        with self.lock:
+            queue = self.responses.get(token)
+            if queue and queue[0]['time'] <= self.clock.time():
+                self.replayed += 1
+                return queue.popleft()
+        return None
+
+    def get(self, url, headers=None, params=None, **kwargs):
+        """Ответ API для токена из заголовка."""
+        event = self.next_event(headers['Authorization'].split()[-1])
+        if event is None:
+            return ReplayResponse(200, {
+                'homeworks': [], 'current_date': int(self.clock.time())
+            })
+        if 'error' in event:
+            raise requests.exceptions.ConnectionError(event['error'])
+        return ReplayResponse(
+            event['status'], event['body'], event.get('retry_after')
+        )
+
+
+class ReplayBot:
+    """Бот, запоминающий сообщения вместо отправки."""
+
+    def __init__(self):
+        """Сообщения хранятся в порядке отправки."""
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def call(self, method, chat_id=None, text='', **kwargs):
+        """Запоминание вызова и ответ с номером сообщения."""
+        with self.lock:
+            self.messages.append((str(chat_id), method, text))
+            return SimpleNamespace(message_id=len(self.messages))
+
+    def send_message(self, chat_id=None, text=None, **kwargs):
+        """Отправка сообщения."""
+        return self.call('send_message', chat_id, text)
+
+    def edit_message_text(self, text=None, chat_id=None, **kwargs):
+        """Правка сообщения."""
+        return self.call('edit_message_text', chat_id, text)
+
+    def pin_chat_message(self, chat_id=None, **kwargs):
+        """Закрепление сообщения."""
+        return self.call('pin_chat_message', chat_id)
+
+
+def read_log(path):
+    """События журнала в порядке записи."""
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def main():
+    """Воспроизведение журнала и сводка по сообщениям."""
+    args = parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+    events = read_log(args.log)
+    tenants = [
+        homework.Tenant(token, chat)
+        for event in events if event['kind'] == 'tenants'
+        for token, chat in event['tenants']
+    ]
+    if args.speed:
+        clock = ScaledClock(args.speed, events[0]['time'])
+    else:
+        clock = homework.SimulatedClock(events[0]['time'])
+    homework.CLOCK = clock
+    session = ReplaySession(
+        [event for event in events if event['kind'] == 'api'], clock
+    )
+    bot = ReplayBot()
+    engine = homework.PollingEngine(bot, tenants, session=session)
+    until = events[-1]['time'] + homework.RETRY_TIME_MAX
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    engine.run_forever(until)
+    if profiler:
+        profiler.disable()
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    recorded = sum(event['kind'] == 'telegram' for event in events)
+    print(
+        f'Подписчиков {len(tenants)}, ответов API {session.replayed}, '
+        f'{(until - events[0]["time"]) / 3600:.1f} ч журнала '
+        f'за {elapsed:.1f} с, процессор {cpu:.1f} с'
+    )
+    print(
+        f'Вызовов Telegram: записано {recorded}, '
+        f'воспроизведено {len(bot.messages)}'
+    )
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            for chat, method, text in sorted(
+                bot.messages, key=lambda message: message[0]
+            ):
+                file.write(f'{chat}\t{method}\t{text}\n')
+    if profiler:
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+
+
+if __name__ == '__main__':
+    main()
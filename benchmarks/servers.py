@@ -0,0 +1,160 @@
+"""Локальные заглушки API Практикума и Telegram Bot API для бенчмарков."""
+import json
+import os
+import random
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+API_PATH = '/api/user_api/homework_statuses/'
+STATUSES = ('reviewing', 'approved', 'rejected')
+
+
+class JSONHandler(BaseHTTPRequestHandler):
+    """Ответы в JSON с поддержкой keep-alive и задержкой из настроек."""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def reply(self, data, status=200):
+        """Ответ с телом в JSON после настроенной задержки."""
+        latency = getattr(self.server, 'latency', 0)
+        if latency:
+            time.sleep(latency)
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Журнал запросов не нужен."""
+
+
+class PracticumHandler(JSONHandler):
+    """Заглушка homework_statuses.
+
+    Настройки сервера: latency — задержка ответа в секундах,
+    error_rate — доля ответов с кодом 500, churn — доля ответов
+    с новым статусом домашней работы.
+    """
+
+    def do_GET(self):
+        """Ответ в формате homework_statuses."""
+        if random.random() < getattr(self.server, 'error_rate', 0):
+            self.reply({}, 500)
+            return
+        homeworks = []
+        if random.random() < getattr(self.server, 'churn', 0):
+            homeworks.append({
+                'id': random.randint(1, 20),
+                'homework_name': 'homework',
+                'status': random.choice(STATUSES),
+                'date_updated': time.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            })
+        self.reply({'homeworks': homeworks, 'current_date': int(time.time())})
+
+
+class HistoryHandler(JSONHandler):
+    """Заглушка homework_statuses с полной историей работ.
+
+    Настройка сервера homeworks — число работ в ответе; тело ответа
+    строится один раз и отдаётся частями.
+    """
+
+    def do_GET(self):
+        """Ответ со всеми работами от новых к старым."""
+        with self.server.lock:
+            if getattr(self.server, 'body', None) is None:
+                self.server.body = json.dumps({
+                    'homeworks': [
+                        {
+                            'id': number,
+                            'homework_name': f'homework_{number}.zip',
+                            'status': STATUSES[number % len(STATUSES)],
+                            'reviewer_comment': 'Комментарий ревьюера. ' * 5,
+                            'date_updated': '2022-01-01T00:00:00Z',
+                            'lesson_name': f'Урок {number}',
+                        }
+                        for number in range(self.server.homeworks, 0, -1)
+                    ],
+                    'current_date': int(time.time()),
+                }).encode()
+        body = self.server.body
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        for start in range(0, len(body), 64 * 1024):
+            self.wfile.write(body[start:start + 64 * 1024])
+
+
+class TelegramHandler(JSONHandler):
+    """Заглушка метода sendMessage Telegram Bot API."""
+
+    def do_POST(self):
+        """Ответ в формате sendMessage."""
+        length = int(self.headers.get('Content-Length', 0))
+        data = json.loads(self.rfile.read(length) or b'{}')
+        with self.server.lock:
+            self.server.sent += 1
+            message_id = self.server.sent
+        self.reply({'ok': True, 'result': {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': int(data.get('chat_id', 0)), 'type': 'private'},
+            'text': data.get('text', ''),
+        }})
+
+
+class Server(ThreadingHTTPServer):
+    """Многопоточный сервер с длинной очередью соединений."""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def make_certificate(directory):
+    """Самоподписанный сертификат для localhost."""
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    subprocess.run(
+        [
+            'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+            '-keyout', key, '-out', cert, '-days', '1',
+            '-subj', '/CN=localhost',
+            '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1',
+        ],
+        check=True, capture_output=True
+    )
+    return cert, key
+
+
+def start_server(handler=PracticumHandler, https=True, path=API_PATH,
+                 **settings):
+    """Запуск заглушки в фоновом потоке, возвращает сервер и URL."""
+    server = Server(('127.0.0.1', 0), handler)
+    server.lock = threading.Lock()
+    server.sent = 0
+    for name, value in settings.items():
+        setattr(server, name, value)
+    scheme = 'http'
+    if https:
+        directory = tempfile.mkdtemp()
+        cert, key = make_certificate(directory)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        os.environ['REQUESTS_CA_BUNDLE'] = cert
+        scheme = 'https'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, f'{scheme}://localhost:{port}{path}'
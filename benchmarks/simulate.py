@@ -0,0 +1,160 @@
+"""Симуляция недель опроса тысяч подписчиков на модельных часах.
+
+Запуск: python benchmarks/simulate.py [--tenants 1000] [--days 7]
+        [--engine threads|asyncio] [--seed 1] [--profile]
+
+Бот работает на homework.SimulatedClock: паузы цикла, повторы и
+ограничители частоты не ждут, поэтому время прогона — это процессорное
+время самого цикла опроса. API заменён клиентом в памяти: у каждого
+подписчика работы сдаются в случайные моменты, проверяются и принимаются
+либо возвращаются на доработку. Печатаются число опросов и сообщений,
+процессорное время и опросы в секунду — для сравнения между сборками.
+"""
+import argparse
+import bisect
+import cProfile
+import logging
+import pstats
+import random
+import threading
+import time
+
+import servers  # noqa: F401  добавляет корень репозитория в sys.path
+
+import homework
+from replay import ReplayBot, ReplayResponse
+
+START = 1_700_000_000
+DAY = 86400
+
+
+def parse_args():
+    """Параметры симуляции."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--tenants', type=int, default=1000,
+                        help='число подписчиков')
+    parser.add_argument('--days', type=float, default=7,
+                        help='длительность в модельных сутках')
+    parser.add_argument('--engine', choices=sorted(homework.ENGINES),
+                        default='threads', help='цикл опроса')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='зерно генератора истории работ')
+    parser.add_argument('--profile', action='store_true',
+                        help='профилировать цикл опроса')
+    return parser.parse_args()
+
+
+def make_timeline(generator, days):
+    """События одного подписчика: (момент, номер работы, статус)."""
+    events = []
+    at = START
+    for homework_id in range(1, 1 + int(days) + 1):
+        at += generator.uniform(0.5, 2) * DAY
+        events.append((at, homework_id, 'reviewing'))
+        verdict = generator.choice(['approved', 'rejected'])
+        events.append((at + generator.uniform(1, 24) * 3600, homework_id,
+                       verdict))
+    return sorted(events)
+
+
+class SimulatedSession:
+    """Клиент API в памяти с историей работ каждого токена.
+
+    Как и настоящий API, отдаёт работы, обновлённые с from_date,
+    по состоянию на текущий момент модельных часов.
+    """
+
+    def __init__(self, timelines, clock):
+        """timelines — события подписчиков по токенам."""
+        self.timelines = timelines
+        self.moments = {
+            token: [event[0] for event in events]
+            for token, events in timelines.items()
+        }
+        self.clock = clock
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def get(self, url, headers=None, params=None, **kwargs):
+        """Ответ API для токена из заголовка."""
+        with self.lock:
+            self.requests += 1
+        token = headers['Authorization'].split()[-1]
+        now = self.clock.time()
+        moments = self.moments[token]
+        events = self.timelines[token][
+            bisect.bisect_left(moments, params['from_date']):
+            bisect.bisect_right(moments, now)
+        ]
+        latest = {homework_id: status for _, homework_id, status in events}
+        return ReplayResponse(200, {
+            'homeworks': [
+                {
+                    'id': homework_id,
+                    'homework_name': f'hw{homework_id}',
+                    'status': status,
+                }
+                for homework_id, status in sorted(
+                    latest.items(), reverse=True
+                )
+            ],
+            'current_date': int(now),
+        })
+
+
+class AsyncSimulatedSession(SimulatedSession):
+    """Клиент API в памяти для асинхронного цикла опроса."""
+
+    async def get(self, url, headers=None, params=None, **kwargs):
+        """Ответ API для токена из заголовка."""
+        return SimulatedSession.get(self, url, headers, params)
+
+
+def main():
+    """Симуляция и сводка."""
+    args = parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+    generator = random.Random(args.seed)
+    clock = homework.SimulatedClock(START)
+    homework.CLOCK = clock
+    tenants = [
+        homework.Tenant(f'token-{number}', number)
+        for number in range(args.tenants)
+    ]
+    engine_class = homework.ENGINES[args.engine]
+    if issubclass(engine_class, homework.AsyncPollingEngine):
+        session_class = AsyncSimulatedSession
+    else:
+        session_class = SimulatedSession
+    session = session_class({
+        tenant.practicum_token: make_timeline(generator, args.days)
+        for tenant in tenants
+    }, clock)
+    bot = ReplayBot()
+    engine = engine_class(bot, tenants, session=session)
+    until = START + args.days * DAY
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    engine.run_forever(until)
+    if profiler:
+        profiler.disable()
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    print(
+        f'Подписчиков {len(tenants)}, {args.days:g} модельных суток '
+        f'за {elapsed:.1f} с, процессор {cpu:.1f} с'
+    )
+    print(
+        f'Опросов API {session.requests} '
+        f'({session.requests / cpu:.0f} в секунду процессора), '
+        f'сообщений {len(bot.messages)}'
+    )
+    if profiler:
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,42 @@
+import asyncio
+import bisect
+import fcntl
+import gzip
+import hashlib
+import heapq
+import json
+import math
 import logging
 import os
+import queue
+import random
+import re
+import signal
+import sqlite3
 import sys
+import threading
 import time
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, wait
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from functools import partial
 from http import HTTPStatus
 
+import aiohttp
 import requests
 import telegram
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from telegram.utils.request import Request
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+
+import json_stream
+import log_pipeline
+from log_pipeline import error_signature
+from metrics import Counter, Gauge, Histogram, Registry, start_metrics_server
+from shard_supervisor import Supervisor, stop_on_signal
 
 load_dotenv()
 
@@ -14,11 +44,178 @@ load_dotenv()
 PRACTICUM_TOKEN = os.getenv('PRACTICUM_TOKEN')
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
+TENANTS_FILE = os.getenv('TENANTS_FILE')
+POLL_WORKERS = int(os.getenv('POLL_WORKERS', 32))
+POLL_MODE = os.getenv('POLL_MODE', 'threads')
+ASYNC_CONCURRENCY = int(os.getenv('ASYNC_CONCURRENCY', 256))
+STATE_DB = os.getenv('STATE_DB', 'homework_state.db')
+API_CONNECT_TIMEOUT = float(os.getenv('API_CONNECT_TIMEOUT', 5))
+API_READ_TIMEOUT = float(os.getenv('API_READ_TIMEOUT', 15))
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv('TELEGRAM_CONNECT_TIMEOUT', 5))
+TELEGRAM_READ_TIMEOUT = float(os.getenv('TELEGRAM_READ_TIMEOUT', 10))
+CYCLE_DEADLINE = float(os.getenv('CYCLE_DEADLINE', 300))
+WATCHDOG_GRACE = float(os.getenv('WATCHDOG_GRACE', 120))
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+COALESCE_WINDOW = float(os.getenv('COALESCE_WINDOW', 120))
+API_RATE = float(os.getenv('API_RATE', 20))
+API_RATE_MIN = float(os.getenv('API_RATE_MIN', 0.5))
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'DEBUG')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 5))
+COMMANDS_POLL_TIMEOUT = int(os.getenv('COMMANDS_POLL_TIMEOUT', 30))
+NOTIFY_MODE = os.getenv('NOTIFY_MODE', 'send')
+DIGEST_WINDOW = float(os.getenv('DIGEST_WINDOW', 0))
+SHARDS = int(os.getenv('SHARDS', 1))
+SHARD_LOCK_DIR = os.getenv('SHARD_LOCK_DIR', '.')
+BACKFILL_CONCURRENCY = int(os.getenv('BACKFILL_CONCURRENCY', 16))
+BACKFILL_CHUNK = int(os.getenv('BACKFILL_CHUNK', 200))
+RECORD_FILE = os.getenv('RECORD_FILE')
 
 RETRY_TIME = 600
+RETRY_TIME_MIN = int(os.getenv('RETRY_TIME_MIN', 120))
+RETRY_TIME_MAX = int(os.getenv('RETRY_TIME_MAX', 3600))
+HOT_STATUSES = ('reviewing',)
+TERMINAL_STATUSES = ('approved', 'rejected')
+ERRORS_KEY = '*'
+MESSAGE_NOT_MODIFIED = 'message is not modified'
+DIGEST_MAX_ITEMS = 20
+TELEGRAM_MESSAGE_LIMIT = 4096
+SHUTDOWN_TIMEOUT = 30
+HASH_REPLICAS = 100
+RING_SIZE = 2 ** 64
+STREAM_CHUNK_SIZE = 64 * 1024
+ASYNC_CLIENT_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+PERMANENT_TELEGRAM_ERRORS = (
+    telegram.error.Unauthorized, telegram.error.BadRequest,
+    telegram.error.ChatMigrated,
+)
+RECORDED_METHODS = ('send_message', 'edit_message_text', 'pin_chat_message')
+SHARD_LOCK_FILE = 'homework-shard-{shard}.lock'
+SCHEDULE_JITTER = 0.1
+SCHEDULE_BATCH = 10
+ERROR_WINDOW = 60 * 60
+ERROR_SIGNATURES = 20
+HISTORY_SIZE = 10
+COMMANDS_RETRY_DELAY = 5
+COMMAND_TIME_FORMAT = '%d.%m %H:%M'
+IDLE_PERIOD = 24 * 60 * 60
+MAX_IDLE_DOUBLINGS = 6
+NIGHT_HOURS = range(0, 7)
+NIGHT_FACTOR = 2
+HOUR = 60 * 60
+SAVINGS_REPORT_PERIOD = HOUR
+DELIVERED_TTL = 7 * IDLE_PERIOD
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_CHAT_RATE = 1
+RETRY_ATTEMPTS = 3
+BACKOFF_BASE = 1
+BACKOFF_MAX = 30
+REDELIVERY_TIME = 60
+REDELIVERY_TIME_MAX = HOUR
+TRANSIENT_STATUSES = (
+    HTTPStatus.REQUEST_TIMEOUT,
+    HTTPStatus.TOO_MANY_REQUESTS,
+    HTTPStatus.INTERNAL_SERVER_ERROR,
+    HTTPStatus.BAD_GATEWAY,
+    HTTPStatus.SERVICE_UNAVAILABLE,
+    HTTPStatus.GATEWAY_TIMEOUT,
+)
+BREAKER_THRESHOLD = 20
+BREAKER_RECOVERY_TIME = 60
+BREAKER_PROBES = 3
+RETRY_AFTER_MAX = 60
+LOG_FILE = __file__ + '.log'
+SECRET_PATTERNS = (
+    (re.compile(r'OAuth [^\s\'",}]+'), 'OAuth ***'),
+    (re.compile(r'bot\d+:[\w-]+'), 'bot***'),
+)
+RATE_INCREASE = 0.05
+RATE_DECREASE = 0.5
+API_TIMEOUT = (API_CONNECT_TIMEOUT, API_READ_TIMEOUT)
+POOL_TIMEOUT = 60
+WATCHDOG_PERIOD = 10
+WATCHDOG_EXIT_CODE = 70
+CYCLE_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600)
 ENDPOINT = 'https://practicum.yandex.ru/api/user_api/homework_statuses/'
 HEADERS = {'Authorization': f'OAuth {PRACTICUM_TOKEN}'}
 TOKENS = ('PRACTICUM_TOKEN', 'TELEGRAM_TOKEN', 'TELEGRAM_CHAT_ID')
+REGISTRY_TOKENS = ('TELEGRAM_TOKEN',)
+SQLITE_SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+SELECT_TENANTS = 'SELECT practicum_token, chat_id FROM tenants'
+STATE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS state (
+    tenant TEXT PRIMARY KEY, timestamp INTEGER, status TEXT, changed_at REAL
+);
+CREATE TABLE IF NOT EXISTS homework_statuses (
+    tenant TEXT, homework TEXT, status TEXT, PRIMARY KEY (tenant, homework)
+);
+CREATE TABLE IF NOT EXISTS delivered (
+    tenant TEXT, fingerprint TEXT, delivered_at REAL,
+    PRIMARY KEY (tenant, fingerprint)
+);
+CREATE TABLE IF NOT EXISTS errors (
+    tenant TEXT, signature TEXT, name TEXT, sent_at REAL, seen_at REAL,
+    count INTEGER, suppressed INTEGER, PRIMARY KEY (tenant, signature)
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    key TEXT PRIMARY KEY, tenant TEXT, fingerprint TEXT, text TEXT,
+    created_at REAL
+);
+CREATE TABLE IF NOT EXISTS backfill (tenant TEXT PRIMARY KEY, done_at REAL);
+CREATE TABLE IF NOT EXISTS status_messages (
+    tenant TEXT, homework TEXT, message_id INTEGER,
+    PRIMARY KEY (tenant, homework)
+);
+CREATE TABLE IF NOT EXISTS schedule (tenant TEXT PRIMARY KEY, next_poll REAL);
+CREATE TABLE IF NOT EXISTS homework_titles (
+    tenant TEXT, homework TEXT, title TEXT, PRIMARY KEY (tenant, homework)
+);
+CREATE TABLE IF NOT EXISTS history (
+    tenant TEXT, at REAL, name TEXT, status TEXT
+);
+CREATE INDEX IF NOT EXISTS history_tenant ON history (tenant, at);
+'''
+SELECT_STATE = 'SELECT tenant, timestamp, status, changed_at FROM state'
+SELECT_ERRORS = (
+    'SELECT tenant, signature, name, sent_at, seen_at, count, suppressed '
+    'FROM errors ORDER BY seen_at'
+)
+SELECT_OUTBOX = (
+    'SELECT key, tenant, fingerprint, text FROM outbox ORDER BY created_at'
+)
+SELECT_BACKFILL = 'SELECT tenant FROM backfill'
+SAVE_BACKFILL = 'INSERT OR REPLACE INTO backfill VALUES (?, ?)'
+SELECT_MESSAGES = 'SELECT tenant, homework, message_id FROM status_messages'
+SELECT_STATUSES = 'SELECT tenant, homework, status FROM homework_statuses'
+SELECT_TITLES = 'SELECT tenant, homework, title FROM homework_titles'
+SELECT_HISTORY = 'SELECT tenant, at, name, status FROM history ORDER BY at'
+SELECT_TENANT_STATE = SELECT_STATE + ' WHERE tenant = ?'
+SELECT_TENANT_STATUSES = SELECT_STATUSES + ' WHERE tenant = ?'
+SELECT_TENANT_TITLES = SELECT_TITLES + ' WHERE tenant = ?'
+SELECT_TENANT_HISTORY = (
+    'SELECT tenant, at, name, status FROM history WHERE tenant = ? '
+    'ORDER BY at'
+)
+SELECT_TENANT_SCHEDULE = 'SELECT next_poll FROM schedule WHERE tenant = ?'
+SELECT_DELIVERED = 'SELECT tenant, fingerprint, delivered_at FROM delivered'
+SAVE_STATE = (
+    'INSERT OR REPLACE INTO state (tenant, timestamp, status, changed_at) '
+    'VALUES (?, ?, ?, ?)'
+)
+CLEAR_ERRORS = 'DELETE FROM errors WHERE tenant = ?'
+SAVE_ERROR = 'INSERT INTO errors VALUES (?, ?, ?, ?, ?, ?, ?)'
+SAVE_OUTBOX = 'INSERT OR IGNORE INTO outbox VALUES (?, ?, ?, ?, ?)'
+DELETE_OUTBOX = 'DELETE FROM outbox WHERE key = ?'
+CLEAR_MESSAGES = 'DELETE FROM status_messages WHERE tenant = ?'
+SAVE_MESSAGE = 'INSERT INTO status_messages VALUES (?, ?, ?)'
+SAVE_STATUS = 'INSERT OR REPLACE INTO homework_statuses VALUES (?, ?, ?)'
+SAVE_DELIVERED = 'INSERT OR IGNORE INTO delivered VALUES (?, ?, ?)'
+SAVE_SCHEDULE = 'INSERT OR REPLACE INTO schedule VALUES (?, ?)'
+SAVE_TITLE = 'INSERT OR REPLACE INTO homework_titles VALUES (?, ?, ?)'
+CLEAR_HISTORY = 'DELETE FROM history WHERE tenant = ?'
+SAVE_HISTORY = 'INSERT INTO history VALUES (?, ?, ?, ?)'
+PRUNE_DELIVERED = 'DELETE FROM delivered WHERE delivered_at < ?'
 GET_API_ANSWER_STATUS_ERROR_MESSAGE = (
     'При обращении к эндпоинту {endpoint}'
     ' с заголовком {header} и параметрами {params} '
@@ -40,12 +237,71 @@ PARSE_STATUS_CHANGE_MESSAGE = (
     '{verdict}'
 )
 SEND_MESSAGE_ERROR = 'Ошибка отправки сообщения {message}: {error}'
+EDIT_MESSAGE_ERROR = (
+    'Не удалось изменить сообщение {message_id}, отправляется новое: {error}'
+)
+DIGEST_MESSAGE = 'Изменения статусов работ ({count}):\n\n{messages}'
+DIGEST_SEPARATOR = '\n\n'
+PIN_MESSAGE_ERROR = 'Не удалось закрепить сообщение {message_id}: {error}'
+RETRY_AFTER_MESSAGE = (
+    'Telegram ограничил отправку, повтор через {seconds} с: {message}'
+)
+CIRCUIT_OPEN_MESSAGE = (
+    'API недоступно: запросы приостановлены после {failures} ошибок подряд'
+)
+BREAKER_STATE_MESSAGE = (
+    'Предохранитель API: {old} -> {new}, ошибок подряд {failures}, '
+    'повторов запросов {retries}'
+)
+BREAKER_STATS_MESSAGE = (
+    'Предохранитель API: {state}, ошибок подряд {failures}, '
+    'повторов запросов {retries}'
+)
+RATE_LIMIT_MESSAGE = (
+    'API ограничивает запросы: лимит снижен до {rate:.2f} в секунду, '
+    'пауза {retry_after} с'
+)
+CYCLE_DEADLINE_MESSAGE = (
+    'Проход опроса не уложился в {deadline} с, отменено подписчиков: {count}'
+)
+WATCHDOG_MESSAGE = (
+    'Цикл опроса не отвечает {seconds:.0f} с, процесс будет перезапущен'
+)
 CHECK_RESPONCE_NOT_DICT = 'В ответе API отсутствует словарь'
 CHECK_RESPONCE_KEY_NO_IN_RESPONSE = 'Ключ "homeworks" не найден'
 CHECK_RESPONCE_KEY_NOT_LIST = 'Значение для ключа "homeworks" не список'
 CHECK_TOKENS_MESSAGE = 'Переменные окружения {names} не найдены либо пусты!'
 MAIN_EXCEPTION_MESSAGE = 'Сбой в работе программы: {error}'
+ERROR_SUMMARY_MESSAGE = (
+    'Сбой в работе программы повторяется: {name} ×{count} '
+    'за последние {minutes} мин'
+)
+ERROR_RECOVERY_MESSAGE = 'Работа бота восстановлена после ошибок: {errors}'
+COMMAND_STATUS_LINE = '"{name}": {verdict}'
+COMMAND_STATUS_EMPTY = 'Статусы домашних работ пока неизвестны'
+COMMAND_HISTORY_LINE = '{time} "{name}": {verdict}'
+COMMAND_HISTORY_EMPTY = 'Изменений статусов пока не было'
+COMMAND_NEXT_MESSAGE = (
+    'Следующая проверка статуса в {time} (через {minutes} мин)'
+)
+COMMAND_NOT_SUBSCRIBED = 'Этот чат не подписан на статусы домашних работ'
+COMMAND_HELP = (
+    '/status — статусы домашних работ, /history — последние изменения, '
+    '/next — время следующей проверки'
+)
+COMMANDS_ERROR = 'Ошибка получения команд из Telegram: {error}'
+COMMAND_ERROR = 'Ошибка обработки команды {update_id}: {error}'
+COMMAND_NEXT_UNKNOWN = 'Время следующей проверки пока неизвестно'
+SHARD_STARTED_MESSAGE = 'Шард {shard} из {shards}: подписчиков {count}'
+BACKFILL_MESSAGE = 'Загрузка истории: подписчиков {loaded} из {total}'
+BACKFILL_ERROR = 'Ошибка загрузки истории: {error}'
 TOKENS_ERROR = 'Недостаточно переменных окружения для работы программы'
+TENANTS_EMPTY_ERROR = 'В реестре {path} не найдено ни одного подписчика'
+TENANTS_LOADED_MESSAGE = 'Загружено подписчиков: {count}, потоков: {workers}'
+SAVINGS_MESSAGE = (
+    'Запросов к API в час: {adaptive:.0f} вместо {fixed:.0f} '
+    'при фиксированном интервале, экономия {saved:.0f}'
+)
 
 
 HOMEWORK_VERDICTS = {
@@ -55,10 +311,554 @@ HOMEWORK_VERDICTS = {
 }
 
 
-def send_message(bot, message):
-    """Отправка сообщения."""
+class APIStatusError(ValueError):
+    """API ответило кодом, отличным от 200."""
+
+    def __init__(self, message, status_code, retry_after=None):
+        """Код ответа и Retry-After сохраняются для обработки ошибки."""
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class ThrottledError(APIStatusError):
+    """API ограничило частоту запросов (429)."""
+
+
+class ServerError(APIStatusError):
+    """Ошибка на стороне API (5xx)."""
+
+
+class CircuitOpenError(Exception):
+    """Запрос не отправлен: предохранитель API разомкнут."""
+
+
+class InlineExecutor(Executor):
+    """Исполнитель, выполняющий задачи сразу в вызывающем потоке."""
+
+    def submit(self, function, *args, **kwargs):
+        """Выполнение задачи; возвращается уже завершённый Future."""
+        future = Future()
+        try:
+            future.set_result(function(*args, **kwargs))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+
+class Clock:
+    """Настоящее время и паузы.
+
+    Через часы идут расписание опросов, паузы цикла, повторы запросов
+    и ограничители частоты; длительности для метрик и сторож цикла
+    измеряются по настоящему времени. Часы же выбирают исполнителя
+    опросов цикла.
+    """
+
+    def time(self):
+        """Текущее время в секундах от эпохи."""
+        return time.time()
+
+    def monotonic(self):
+        """Монотонное время для интервалов."""
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        """Пауза."""
+        time.sleep(seconds)
+
+    def timeout(self, seconds):
+        """Настоящий тайм-аут ожидания очереди на seconds по часам."""
+        return seconds
+
+    def executor(self, workers):
+        """Пул из workers потоков для опросов цикла."""
+        return ThreadPoolExecutor(max_workers=workers)
+
+    async def sleep_async(self, seconds):
+        """Пауза в цикле событий."""
+        await asyncio.sleep(seconds)
+
+
+class SimulatedClock(Clock):
+    """Модельное время для симуляции и тестов.
+
+    Паузы не ждут, а сразу переводят часы вперёд, поэтому недели опроса
+    моделируются за секунды процессорного времени. Паузы разных потоков
+    складываются, поэтому опросы цикла выполняются по очереди в его
+    потоке: так модель детерминирована и не тратит время на переключение
+    потоков. Фоновые потоки, ждущие очередь, проверяют часы каждые wait
+    секунд.
+    """
+
+    def __init__(self, start=0.0, wait=0.01):
+        """Часы начинают идти с момента start."""
+        self.now = start
+        self.wait = wait
+        self.lock = threading.Lock()
+
+    def time(self):
+        """Модельное время."""
+        return self.now
+
+    def monotonic(self):
+        """Модельное время."""
+        return self.now
+
+    def sleep(self, seconds):
+        """Перевод часов на seconds вперёд.
+
+        Любая положительная пауза сдвигает часы хотя бы на шаг float,
+        иначе ожидание жетона в долю наносекунды не кончалось бы.
+        """
+        if seconds <= 0:
+            return
+        with self.lock:
+            self.now = max(
+                self.now + seconds, math.nextafter(self.now, math.inf)
+            )
+
+    def timeout(self, seconds):
+        """Короткое настоящее ожидание вместо модельного."""
+        return seconds if seconds is None else min(seconds, self.wait)
+
+    def executor(self, workers):
+        """Опросы по очереди в потоке цикла."""
+        return InlineExecutor()
+
+    async def sleep_async(self, seconds):
+        """Перевод часов вперёд с передачей управления циклу событий."""
+        self.sleep(seconds)
+        await asyncio.sleep(0)
+
+
+CLOCK = Clock()
+
+
+@dataclass
+class Tenant:
+    """Подписчик бота: токен Практикума и чат Telegram."""
+
+    practicum_token: str
+    chat_id: str
+    timestamp: int = 0
+    errors: object = None
+    status: str = None
+    changed_at: float = 0.0
+    interval: int = RETRY_TIME
+    next_poll: float = 0.0
+    statuses: dict = field(default_factory=dict)
+    delivered: dict = field(default_factory=dict)
+    titles: dict = field(default_factory=dict)
+    message_ids: dict = field(default_factory=dict)
+    digest_window: float = DIGEST_WINDOW
+    history: deque = field(
+        default_factory=partial(deque, maxlen=HISTORY_SIZE)
+    )
+
+    @property
+    def headers(self):
+        """Заголовки запроса к API от имени подписчика."""
+        return {'Authorization': f'OAuth {self.practicum_token}'}
+
+    @property
+    def key(self):
+        """Ключ подписчика в хранилище, не раскрывающий токен."""
+        return hashlib.sha256(
+            f'{self.practicum_token}:{self.chat_id}'.encode()
+        ).hexdigest()[:32]
+
+
+def homework_key(homework):
+    """Идентификатор домашней работы в ответе API."""
+    return str(homework.get('id', homework.get('homework_name')))
+
+
+def homework_fingerprint(homework):
+    """Отпечаток изменения статуса домашней работы."""
+    return '{key}:{status}:{date}'.format(
+        key=homework_key(homework),
+        status=homework.get('status'),
+        date=homework.get('date_updated'),
+    )
+
+
+def outbox_key(tenant, fingerprint):
+    """Ключ идемпотентности сообщения об изменении статуса."""
+    return f'{tenant.key}:{fingerprint}'
+
+
+def outbox_rows(notices, now):
+    """Строки outbox для четвёрок (подписчик, работа, отпечаток, текст)."""
+    return [
+        (outbox_key(tenant, fingerprint), tenant.key, fingerprint, message,
+         now)
+        for tenant, _, fingerprint, message in notices
+    ]
+
+
+def iter_changes(statuses, homeworks):
+    """Домашние работы, статус которых отличается от известного.
+
+    statuses — индекс последних известных статусов по идентификатору работы.
+    homeworks — любая последовательность работ от новых к старым, как их
+    возвращает API, в том числе поток; изменения отдаются по мере чтения,
+    для каждой работы по самой новой записи. Запоминаются только
+    идентификаторы просмотренных работ, поэтому индекс можно обновлять
+    во время обхода.
+    """
+    seen = set()
+    for homework in homeworks:
+        key = homework_key(homework)
+        if key in seen:
+            continue
+        seen.add(key)
+        if homework['status'] != statuses.get(key):
+            yield homework
+
+
+def diff_homeworks(statuses, homeworks):
+    """Изменения статусов в хронологическом порядке.
+
+    Индекс statuses не изменяется.
+    """
+    return list(iter_changes(statuses, homeworks))[::-1]
+
+
+@dataclass
+class ErrorWindow:
+    """Повторы одной ошибки у подписчика."""
+
+    name: str
+    sent_at: float
+    seen_at: float
+    count: int = 1
+    suppressed: int = 0
+
+
+class ErrorAggregator:
+    """Сводка ошибок подписчика вместо сообщения на каждую.
+
+    Первая ошибка с новой сигнатурой отправляется сразу, повторы в течение
+    window секунд копятся и отправляются одной сводкой. Ошибка, не
+    повторявшаяся window секунд, забывается; сигнатур хранится не больше
+    size, самые давние вытесняются. После успешного опроса отправляется
+    сообщение о восстановлении.
+    """
+
+    def __init__(self, window=ERROR_WINDOW, size=ERROR_SIGNATURES):
+        """Сигнатуры хранятся в порядке последнего появления."""
+        self.window = window
+        self.size = size
+        self.entries = OrderedDict()
+
+    def record(self, error, now):
+        """Текст для отправки по ошибке либо None, если её придержать."""
+        signature = error_signature(error)
+        entry = self.entries.get(signature)
+        if entry is None or now - entry.seen_at > self.window:
+            self.entries[signature] = ErrorWindow(
+                type(error).__name__, now, now
+            )
+            self.entries.move_to_end(signature)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+            return MAIN_EXCEPTION_MESSAGE.format(error=error)
+        self.entries.move_to_end(signature)
+        entry.count += 1
+        entry.seen_at = now
+        entry.suppressed += 1
+        if now - entry.sent_at < self.window:
+            return None
+        message = ERROR_SUMMARY_MESSAGE.format(
+            name=entry.name, count=entry.suppressed,
+            minutes=round((now - entry.sent_at) / 60)
+        )
+        entry.suppressed = 0
+        entry.sent_at = now
+        return message
+
+    def recover(self):
+        """Сообщение о восстановлении после ошибок либо None."""
+        if not self.entries:
+            return None
+        message = ERROR_RECOVERY_MESSAGE.format(errors=', '.join(
+            f'{entry.name} ×{entry.count}' for entry in self.entries.values()
+        ))
+        self.entries.clear()
+        return message
+
+
+class StateStore:
+    """Состояние подписчиков в базе SQLite в режиме WAL.
+
+    Сохраняются timestamp, сводка ошибок, статусы домашних работ
+    и отпечатки доставленных сообщений, поэтому после
+    перезапуска бот продолжает опрос с того же места. Названия работ,
+    история изменений и время следующего опроса нужны для ответов
+    на команды, в том числе шардом, который подписчика не опрашивает.
+    Сообщения об изменениях статусов записываются в таблицу outbox
+    до отправки и удаляются после неё, поэтому сбой не теряет их.
+    """
+
+    def __init__(self, path):
+        """Открытие базы и создание таблиц."""
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(STATE_SCHEMA)
+        self.lock = threading.Lock()
+
+    def load(self, tenants):
+        """Восстановление состояния подписчиков из базы."""
+        by_key = {tenant.key: tenant for tenant in tenants}
+        with self.lock:
+            states = self.connection.execute(SELECT_STATE).fetchall()
+            statuses = self.connection.execute(SELECT_STATUSES).fetchall()
+            delivered = self.connection.execute(SELECT_DELIVERED).fetchall()
+            errors = self.connection.execute(SELECT_ERRORS).fetchall()
+            messages = self.connection.execute(SELECT_MESSAGES).fetchall()
+            titles = self.connection.execute(SELECT_TITLES).fetchall()
+            history = self.connection.execute(SELECT_HISTORY).fetchall()
+        for key, timestamp, status, changed_at in states:
+            if key in by_key:
+                tenant = by_key[key]
+                tenant.timestamp = timestamp
+                tenant.status = status
+                tenant.changed_at = changed_at
+        self.fill(by_key, 'statuses', statuses)
+        self.fill(by_key, 'delivered', delivered)
+        self.fill(by_key, 'message_ids', messages)
+        self.fill(by_key, 'titles', titles)
+        for key, *change in history:
+            if key in by_key:
+                by_key[key].history.append(tuple(change))
+        for key, signature, *window in errors:
+            if key in by_key:
+                tenant = by_key[key]
+                tenant.errors = tenant.errors or ErrorAggregator()
+                tenant.errors.entries[signature] = ErrorWindow(*window)
+
+    @staticmethod
+    def fill(by_key, attribute, rows):
+        """Заполнение словаря подписчика строками (ключ, имя, значение)."""
+        for key, name, value in rows:
+            if key in by_key:
+                getattr(by_key[key], attribute)[name] = value
+
+    def refresh(self, tenant):
+        """Состояние подписчика, опрашиваемого другим процессом.
+
+        Читаются статусы, названия работ, история изменений и время
+        следующего опроса — всё, что нужно для ответов на команды.
+        """
+        key = (tenant.key,)
+        with self.lock:
+            query = self.connection.execute
+            states = query(SELECT_TENANT_STATE, key).fetchall()
+            statuses = query(SELECT_TENANT_STATUSES, key).fetchall()
+            titles = query(SELECT_TENANT_TITLES, key).fetchall()
+            history = query(SELECT_TENANT_HISTORY, key).fetchall()
+            schedule = query(SELECT_TENANT_SCHEDULE, key).fetchall()
+        for _, timestamp, status, changed_at in states:
+            tenant.timestamp = timestamp
+            tenant.status = status
+            tenant.changed_at = changed_at
+        tenant.statuses = {
+            homework: status for _, homework, status in statuses
+        }
+        tenant.titles = {homework: title for _, homework, title in titles}
+        tenant.history.clear()
+        tenant.history.extend(tuple(change) for _, *change in history)
+        for next_poll, in schedule:
+            tenant.next_poll = next_poll
+
+    def backfilled(self):
+        """Ключи подписчиков, история которых уже загружена."""
+        with self.lock:
+            return {
+                key for key, in self.connection.execute(SELECT_BACKFILL)
+            }
+
+    def checkpoint(self, keys):
+        """Отметка о загруженной истории подписчиков."""
+        now = CLOCK.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                SAVE_BACKFILL, [(key, now) for key in keys]
+            )
+
+    def enqueue(self, rows):
+        """Запись сообщений (ключ, подписчик, отпечаток, текст, время)."""
+        with self.lock, self.connection:
+            self.connection.executemany(SAVE_OUTBOX, rows)
+
+    def pending(self):
+        """Неподтверждённые сообщения в порядке записи."""
+        with self.lock:
+            return self.connection.execute(SELECT_OUTBOX).fetchall()
+
+    def save(self, tenants, acknowledged=(), enqueued=()):
+        """Сохранение состояния подписчиков одной транзакцией.
+
+        В той же транзакции сообщения enqueued (строки enqueue)
+        записываются в outbox, а сообщения acknowledged удаляются из него.
+        """
+        states, statuses, delivered, errors, messages = [], [], [], [], []
+        schedule, titles, history = [], [], []
+        for tenant in tenants:
+            key = tenant.key
+            states.append((
+                key, tenant.timestamp, tenant.status, tenant.changed_at
+            ))
+            schedule.append((key, tenant.next_poll))
+            titles.extend(
+                (key, homework, title)
+                for homework, title in dict(tenant.titles).items()
+            )
+            history.extend(
+                (key, *change) for change in list(tenant.history)
+            )
+            if tenant.errors:
+                errors.extend(
+                    (key, signature, window.name, window.sent_at,
+                     window.seen_at, window.count, window.suppressed)
+                    for signature, window
+                    in list(tenant.errors.entries.items())
+                )
+            messages.extend(
+                (key, homework, message_id)
+                for homework, message_id in dict(tenant.message_ids).items()
+            )
+            statuses.extend(
+                (key, homework, status)
+                for homework, status in dict(tenant.statuses).items()
+            )
+            delivered.extend(
+                (key, fingerprint, delivered_at)
+                for fingerprint, delivered_at
+                in dict(tenant.delivered).items()
+            )
+        with self.lock, self.connection:
+            self.connection.executemany(SAVE_STATE, states)
+            self.connection.executemany(SAVE_STATUS, statuses)
+            self.connection.executemany(SAVE_DELIVERED, delivered)
+            self.connection.executemany(
+                CLEAR_ERRORS, [(state[0],) for state in states]
+            )
+            self.connection.executemany(SAVE_ERROR, errors)
+            self.connection.executemany(
+                CLEAR_MESSAGES, [(state[0],) for state in states]
+            )
+            self.connection.executemany(SAVE_MESSAGE, messages)
+            self.connection.executemany(SAVE_SCHEDULE, schedule)
+            self.connection.executemany(SAVE_TITLE, titles)
+            self.connection.executemany(
+                CLEAR_HISTORY, [(state[0],) for state in states]
+            )
+            self.connection.executemany(SAVE_HISTORY, history)
+            self.connection.executemany(SAVE_OUTBOX, enqueued)
+            self.connection.executemany(
+                DELETE_OUTBOX, [(key,) for key in acknowledged]
+            )
+            self.connection.execute(
+                PRUNE_DELIVERED, (CLOCK.time() - DELIVERED_TTL,)
+            )
+
+    def close(self):
+        """Закрытие базы."""
+        self.connection.close()
+
+
+class Metrics(Registry):
+    """Метрики бота, отдаваемые в формате Prometheus."""
+
+    def __init__(self):
+        """Все метрики создаются заранее."""
+        self.api_latency = Histogram(
+            'homework_api_request_seconds', 'Длительность запроса к API'
+        )
+        self.send_latency = Histogram(
+            'homework_telegram_send_seconds',
+            'Длительность отправки сообщения в Telegram'
+        )
+        self.cycle_duration = Histogram(
+            'homework_poll_cycle_seconds', 'Длительность прохода опроса',
+            CYCLE_BUCKETS
+        )
+        self.errors = Counter(
+            'homework_poll_errors_total', 'Ошибки опроса по типу', 'type'
+        )
+        self.polls = Counter('homework_polls_total', 'Опросы подписчиков')
+        self.tenants_per_second = Gauge(
+            'homework_tenants_per_second',
+            'Подписчиков в секунду за последний проход'
+        )
+        self.due_tenants = Gauge(
+            'homework_due_tenants', 'Подписчиков в последнем проходе'
+        )
+        self.outbox_depth = Gauge(
+            'homework_outbox_depth', 'Сообщений в очереди на отправку'
+        )
+        self.coalesced = Counter(
+            'homework_coalesced_requests_total',
+            'Запросы к API, объединённые с уже выполняемыми'
+        )
+        self.coalesce_hit_ratio = Gauge(
+            'homework_coalesce_hit_ratio',
+            'Доля опросов, обслуженных без нового запроса к API'
+        )
+        self.telegram_calls = Counter(
+            'homework_telegram_calls_total', 'Вызовы Telegram Bot API',
+            'method'
+        )
+        self.command_latency = Histogram(
+            'homework_command_seconds', 'Длительность ответа на команду'
+        )
+        self.api_rate_limit = Gauge(
+            'homework_api_rate_limit',
+            'Текущий лимит запросов к API в секунду'
+        )
+
+
+METRICS = Metrics()
+
+
+def redact(text):
+    """Текст с замаскированными токенами Практикума и Telegram."""
+    for pattern, replacement in SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def redact_headers(headers):
+    """Заголовки запроса без токена для сообщений об ошибках."""
+    return {
+        name: redact(str(value)) if name == 'Authorization' else value
+        for name, value in headers.items()
+    }
+
+
+def setup_logging(log_file=LOG_FILE):
+    """Логирование с настройками LOG_* и маскированием токенов.
+
+    Возвращает запущенный QueueListener.
+    """
+    return log_pipeline.setup_logging(
+        log_file, level=LOG_LEVEL, json_format=LOG_FORMAT == 'json',
+        max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT,
+        redact=redact,
+    )
+
+
+def send_to_chat(bot, chat_id, message):
+    """Отправка сообщения в указанный чат."""
     try:
-        bot.send_message(chat_id=TELEGRAM_CHAT_ID, text=message)
+        started = time.monotonic()
+        bot.send_message(
+            chat_id=chat_id, text=message, timeout=TELEGRAM_READ_TIMEOUT
+        )
+        METRICS.send_latency.observe(time.monotonic() - started)
         logging.info(message)
         return True
     except (telegram.error.TelegramError, Exception) as error:
@@ -66,103 +866,2164 @@ def send_message(bot, message):
         return False
 
 
-def get_api_answer(timestamp):
-    """Отправка запроса к эндпоинту API-сервиса."""
+def send_message(bot, message):
+    """Отправка сообщения."""
+    return send_to_chat(bot, TELEGRAM_CHAT_ID, message)
+
+
+class BufferedResponse:
+    """Прочитанный целиком ответ асинхронного клиента."""
+
+    def __init__(self, status_code, headers, content):
+        """Код, заголовки и тело ответа."""
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        """Тело ответа в JSON."""
+        return json.loads(self.content)
+
+
+class AsyncSession:
+    """Асинхронный клиент API на aiohttp с пулом keep-alive соединений.
+
+    Сессия aiohttp привязана к циклу событий, поэтому создаётся при первом
+    запросе и закрывается методом close в том же цикле.
+    """
+
+    def __init__(self, pool_size=ASYNC_CONCURRENCY):
+        """В пуле не больше pool_size соединений."""
+        self.pool_size = pool_size
+        self.session = None
+
+    async def get(self, url, headers=None, params=None, timeout=API_TIMEOUT):
+        """Ответ на GET-запрос; timeout — (подключение, чтение)."""
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size)
+            )
+        connect_timeout, read_timeout = timeout
+        async with self.session.get(
+            url, headers=headers, params=params,
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=connect_timeout, sock_read=read_timeout
+            )
+        ) as response:
+            return BufferedResponse(
+                response.status, response.headers, await response.read()
+            )
+
+    async def close(self):
+        """Закрытие соединений пула."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class PoolTimeoutMixin:
+    """Пул urllib3, ждущий свободное соединение не дольше POOL_TIMEOUT.
+
+    requests не передаёт пулу pool_timeout, и без него соединение,
+    не возвращённое в пул, навсегда блокирует следующий запрос.
+    """
+
+    def urlopen(self, method, url, *args, pool_timeout=None, **kwargs):
+        """Запрос с ожиданием соединения не дольше POOL_TIMEOUT."""
+        if pool_timeout is None:
+            pool_timeout = POOL_TIMEOUT
+        return super().urlopen(
+            method, url, *args, pool_timeout=pool_timeout, **kwargs
+        )
+
+
+class TimedHTTPConnectionPool(PoolTimeoutMixin, HTTPConnectionPool):
+    """Пул HTTP-соединений с ожиданием не дольше POOL_TIMEOUT."""
+
+
+class TimedHTTPSConnectionPool(PoolTimeoutMixin, HTTPSConnectionPool):
+    """Пул HTTPS-соединений с ожиданием не дольше POOL_TIMEOUT."""
+
+
+class PoolTimeoutAdapter(HTTPAdapter):
+    """Транспорт requests на пулах с ограниченным ожиданием соединения."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        """Менеджер пулов с TimedHTTPConnectionPool."""
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+
+def make_session(pool_size=POLL_WORKERS):
+    """HTTP-сессия с пулом keep-alive соединений к API-сервису."""
+    session = requests.Session()
+    adapter = PoolTimeoutAdapter(
+        pool_connections=1, pool_maxsize=pool_size, pool_block=True
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def traffic_id(value):
+    """Обезличенный идентификатор токена либо чата в журнале трафика."""
+    return hashlib.sha256(str(value).encode()).hexdigest()[:16]
+
+
+class Recorder:
+    """Журнал трафика API и Telegram для воспроизведения.
+
+    Записи — строки JSON в файле gzip. Токены и чаты заменяются
+    обезличенными идентификаторами, тексты сообщений маскируются.
+    """
+
+    def __init__(self, path):
+        """Журнал дописывается, если файл уже существует."""
+        self.file = gzip.open(path, 'at', encoding='utf-8')
+        self.lock = threading.Lock()
+
+    def write(self, kind, **data):
+        """Запись события с текущим временем."""
+        line = json.dumps(
+            {'time': CLOCK.time(), 'kind': kind, **data}, ensure_ascii=False
+        )
+        with self.lock:
+            self.file.write(line + '\n')
+
+    def tenants(self, tenants):
+        """Запись состава подписчиков."""
+        self.write('tenants', tenants=[
+            [traffic_id(tenant.practicum_token), traffic_id(tenant.chat_id)]
+            for tenant in tenants
+        ])
+
+    def close(self):
+        """Закрытие журнала."""
+        with self.lock:
+            self.file.close()
+
+
+class RecordingSession:
+    """Клиент API, записывающий ответы в журнал трафика."""
+
+    def __init__(self, session, recorder):
+        """Запросы выполняет session — клиент с методом get."""
+        self.session = session
+        self.recorder = recorder
+
+    @staticmethod
+    def event(headers, params):
+        """Поля записи: обезличенный токен и from_date запроса."""
+        token = traffic_id(headers['Authorization'].split()[-1])
+        return {'token': token, 'from_date': params.get('from_date')}
+
+    def write(self, event, response, stream=False):
+        """Запись ответа API в журнал."""
+        body = None
+        if not stream:
+            try:
+                body = response.json()
+            except ValueError:
+                body = None
+        self.recorder.write(
+            'api', status=response.status_code, body=body,
+            retry_after=response.headers.get('Retry-After'), **event
+        )
+        return response
+
+    def get(self, url, headers=None, params=None, **kwargs):
+        """Запрос к API с записью ответа либо ошибки соединения."""
+        event = self.event(headers, params)
+        try:
+            response = self.session.get(
+                url, headers=headers, params=params, **kwargs
+            )
+        except requests.exceptions.RequestException as error:
+            self.recorder.write('api', error=redact(str(error)), **event)
+            raise
+        return self.write(event, response, kwargs.get('stream'))
+
+
+class AsyncRecordingSession(RecordingSession):
+    """Асинхронный клиент API, записывающий ответы в журнал трафика."""
+
+    async def get(self, url, headers=None, params=None, **kwargs):
+        """Запрос к API с записью ответа либо ошибки соединения."""
+        event = self.event(headers, params)
+        try:
+            response = await self.session.get(
+                url, headers=headers, params=params, **kwargs
+            )
+        except ASYNC_CLIENT_ERRORS as error:
+            self.recorder.write('api', error=redact(str(error)), **event)
+            raise
+        return self.write(event, response)
+
+    async def close(self):
+        """Закрытие соединений записываемого клиента."""
+        await self.session.close()
+
+
+class RecordingBot:
+    """Обёртка бота, записывающая вызовы отправки в журнал трафика."""
+
+    def __init__(self, bot, recorder):
+        """Остальные методы бота вызываются без записи."""
+        self.bot = bot
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        """Метод бота; методы отправки записываются."""
+        method = getattr(self.bot, name)
+        if name not in RECORDED_METHODS:
+            return method
+
+        def recorded(*args, **kwargs):
+            self.recorder.write(
+                'telegram', method=name,
+                chat=traffic_id(kwargs.get('chat_id')),
+                text=redact(str(kwargs.get('text', ''))),
+                message_id=kwargs.get('message_id')
+            )
+            return method(*args, **kwargs)
+
+        return recorded
+
+
+def parse_retry_after(value):
+    """Пауза в секундах из заголовка Retry-After либо None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - CLOCK.time())
+
+
+def status_error(response, message):
+    """Ошибка, соответствующая коду ответа API."""
+    status_code = response.status_code
+    if status_code == HTTPStatus.TOO_MANY_REQUESTS:
+        error_class = ThrottledError
+    elif status_code >= HTTPStatus.INTERNAL_SERVER_ERROR:
+        error_class = ServerError
+    else:
+        return APIStatusError(message, status_code)
+    headers = getattr(response, 'headers', {})
+    return error_class(
+        message, status_code, parse_retry_after(headers.get('Retry-After'))
+    )
+
+
+def open_api(timestamp, headers, session=requests, **options):
+    """Ответ эндпоинта API-сервиса с кодом 200.
+
+    session — клиент с методом get: модуль requests
+    либо requests.Session с пулом соединений.
+    """
     params = {'from_date': timestamp}
+    started = time.monotonic()
     try:
-        response = requests.get(
-            ENDPOINT, headers=HEADERS, params=params
+        response = session.get(
+            ENDPOINT, headers=headers, params=params, timeout=API_TIMEOUT,
+            **options
         )
-    except requests.exceptions.RequestException as error:
+    except (requests.exceptions.RequestException, EmptyPoolError) as error:
+        METRICS.api_latency.observe(time.monotonic() - started)
         raise ConnectionError(CONNECTION_ERROR.format(
             error=error,
             enpoint=ENDPOINT,
-            header=HEADERS,
+            header=redact_headers(headers),
             params=params
         ))
+    METRICS.api_latency.observe(time.monotonic() - started)
+    try:
+        return check_status(response, params, headers)
+    except Exception:
+        if options.get('stream'):
+            response.close()
+        raise
+
+
+def check_status(response, params, headers):
+    """Ответ API, если его код 200, иначе ошибка по коду ответа."""
     if response.status_code != HTTPStatus.OK:
-        raise ValueError(
+        raise status_error(
+            response,
             GET_API_ANSWER_STATUS_ERROR_MESSAGE.format(
                 endpoint=ENDPOINT,
-                header=HEADERS,
+                header=redact_headers(headers),
                 params=params,
                 status_code=response.status_code
             )
         )
-    server_responce = response.json()
+    return response
+
+
+async def open_api_async(timestamp, headers, client):
+    """Ответ эндпоинта API-сервиса с кодом 200 через асинхронный клиент.
+
+    client — клиент с корутиной get, например AsyncSession.
+    """
+    params = {'from_date': timestamp}
+    started = time.monotonic()
+    try:
+        response = await client.get(
+            ENDPOINT, headers=headers, params=params, timeout=API_TIMEOUT
+        )
+    except ASYNC_CLIENT_ERRORS as error:
+        METRICS.api_latency.observe(time.monotonic() - started)
+        raise ConnectionError(CONNECTION_ERROR.format(
+            error=error,
+            enpoint=ENDPOINT,
+            header=redact_headers(headers),
+            params=params
+        ))
+    METRICS.api_latency.observe(time.monotonic() - started)
+    return check_status(response, params, headers)
+
+
+def check_api_error(server_responce, timestamp, headers):
+    """Проверка, что API не вернуло ошибку в теле ответа."""
     for key in ['code', 'error']:
         if key in server_responce:
             raise ValueError(KEY_ERROR.format(
                 key=key,
                 value=server_responce.get(key),
-                endpoint=ENDPOINT,
-                header=HEADERS,
-                params=params,
+                enpoint=ENDPOINT,
+                header=redact_headers(headers),
+                params={'from_date': timestamp},
             ))
     return server_responce
 
 
-def check_response(response):
-    """Проверка корректности ответа API."""
-    if not isinstance(response, dict):
-        raise TypeError(CHECK_RESPONCE_NOT_DICT)
-    if 'homeworks' not in response:
-        raise KeyError(CHECK_RESPONCE_KEY_NO_IN_RESPONSE)
-    if not isinstance(response.get('homeworks'), list):
-        raise TypeError(CHECK_RESPONCE_KEY_NOT_LIST)
-    return response.get('homeworks')
+def request_api(timestamp, headers, session=requests):
+    """Запрос к эндпоинту API-сервиса с заданными заголовками."""
+    return check_api_error(
+        open_api(timestamp, headers, session).json(), timestamp, headers
+    )
 
 
-def parse_status(homework):
-    """Получение статуса конкретной домашней работы."""
-    name = homework['homework_name']
-    status = homework['status']
-    if status not in HOMEWORK_VERDICTS:
-        raise ValueError(PARSE_STATUS_MESSAGE.format(status=status))
-    return PARSE_STATUS_CHANGE_MESSAGE.format(
-        name=name,
-        verdict=HOMEWORK_VERDICTS[status]
+async def request_api_async(timestamp, headers, client):
+    """Запрос к эндпоинту API-сервиса через асинхронный клиент."""
+    response = await open_api_async(timestamp, headers, client)
+    return check_api_error(response.json(), timestamp, headers)
+
+
+def stream_api(timestamp, headers, fields, session=requests):
+    """Домашние работы из ответа API по одной, без чтения тела целиком.
+
+    Поля ответа, кроме homeworks, записываются в fields и проверяются
+    после чтения ответа.
+    """
+    with open_api(timestamp, headers, session, stream=True) as response:
+        yield from iter_homeworks(
+            response.iter_content(STREAM_CHUNK_SIZE), fields
+        )
+    check_response(check_api_error(fields, timestamp, headers))
+
+
+def iter_homeworks(chunks, fields):
+    """Домашние работы из ответа API, читаемого по частям.
+
+    Записи массива homeworks отдаются по одной, не дожидаясь конца
+    ответа; остальные поля верхнего уровня записываются в fields,
+    а вместо homeworks — пустой список.
+    """
+    reader = json_stream.JSONStreamReader(chunks)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key == 'homeworks':
+            if reader.peek() != '[':
+                raise TypeError(CHECK_RESPONCE_KEY_NOT_LIST)
+            fields[key] = []
+            yield from reader.items()
+        else:
+            fields[key] = reader.value()
+        if reader.expect(',}') == '}':
+            return
+
+
+def get_api_answer(timestamp):
+    """Отправка запроса к эндпоинту API-сервиса."""
+    return request_api(timestamp, HEADERS)
+
+
+def is_transient(error):
+    """Временная ли ошибка запроса к API, имеет ли смысл повтор."""
+    if isinstance(error, APIStatusError):
+        return error.status_code in TRANSIENT_STATUSES
+    return isinstance(error, ConnectionError)
+
+
+def backoff_delay(attempt):
+    """Пауза перед повтором: экспонента со случайным разбросом."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def call_with_retries(function, breaker, limiter=None,
+                      attempts=RETRY_ATTEMPTS):
+    """Вызов запроса к API с повторами при временных ошибках.
+
+    Если передан limiter, запросы проходят через него, а ответы
+    с Retry-After снижают его лимит. Повтор ждёт не меньше Retry-After;
+    при паузе длиннее RETRY_AFTER_MAX ошибка возвращается сразу.
+    """
+    for attempt in range(attempts):
+        if limiter:
+            limiter.acquire()
+        try:
+            result = breaker.call(function)
+        except Exception as error:
+            pause = retry_pause(error, attempt, attempts, breaker, limiter)
+            if pause is None:
+                raise
+            CLOCK.sleep(pause)
+            continue
+        if limiter:
+            limiter.succeed()
+        return result
+
+
+async def call_with_retries_async(function, breaker, limiter=None,
+                                  attempts=RETRY_ATTEMPTS):
+    """Асинхронный вариант call_with_retries: function возвращает корутину."""
+    for attempt in range(attempts):
+        if limiter:
+            await limiter.acquire_async()
+        try:
+            result = await breaker.call_async(function)
+        except Exception as error:
+            pause = retry_pause(error, attempt, attempts, breaker, limiter)
+            if pause is None:
+                raise
+            await CLOCK.sleep_async(pause)
+            continue
+        if limiter:
+            limiter.succeed()
+        return result
+
+
+def retry_pause(error, attempt, attempts, breaker, limiter=None):
+    """Пауза перед повтором запроса после ошибки либо None без повтора.
+
+    Ответ с Retry-After снижает лимит limiter, пауза не короче Retry-After.
+    """
+    retry_after = getattr(error, 'retry_after', None)
+    if limiter and (retry_after or isinstance(error, ThrottledError)):
+        limiter.throttle(retry_after)
+    if (not is_transient(error) or attempt == attempts - 1
+            or (retry_after or 0) > RETRY_AFTER_MAX):
+        return None
+    breaker.count_retry()
+    return max(backoff_delay(attempt), retry_after or 0)
+
+
+def check_response(response):
+    """Проверка корректности ответа API."""
+    if not isinstance(response, dict):
+        raise TypeError(CHECK_RESPONCE_NOT_DICT)
+    if 'homeworks' not in response:
+        raise KeyError(CHECK_RESPONCE_KEY_NO_IN_RESPONSE)
+    if not isinstance(response.get('homeworks'), list):
+        raise TypeError(CHECK_RESPONCE_KEY_NOT_LIST)
+    return response.get('homeworks')
+
+
+def parse_status(homework):
+    """Получение статуса конкретной домашней работы."""
+    name = homework['homework_name']
+    status = homework['status']
+    if status not in HOMEWORK_VERDICTS:
+        raise ValueError(PARSE_STATUS_MESSAGE.format(status=status))
+    return PARSE_STATUS_CHANGE_MESSAGE.format(
+        name=name,
+        verdict=HOMEWORK_VERDICTS[status]
     )
 
 
 def check_tokens():
     """Проверка доступности переменных окружения."""
-    tokens = [token for token in TOKENS if not globals()[token]]
+    names = REGISTRY_TOKENS if TENANTS_FILE else TOKENS
+    tokens = [token for token in names if not globals()[token]]
     if tokens:
         logging.critical(CHECK_TOKENS_MESSAGE.format(names=tokens))
     return not tokens
 
 
-def main():
-    """Основная логика работы бота."""
+def poll_interval(status, changed_at, now):
+    """Пауза до следующего опроса подписчика.
+
+    Работы на проверке опрашиваются чаще всего, а за каждые сутки
+    без изменений статуса пауза удваивается — в том числе у затянувшейся
+    проверки; ночью она ещё вдвое длиннее. Результат ограничен
+    RETRY_TIME_MIN и RETRY_TIME_MAX.
+    """
+    base = RETRY_TIME_MIN if status in HOT_STATUSES else RETRY_TIME
+    idle_days = int((now - changed_at) // IDLE_PERIOD)
+    interval = base * 2 ** min(idle_days, MAX_IDLE_DOUBLINGS)
+    if time.localtime(now).tm_hour in NIGHT_HOURS:
+        interval *= NIGHT_FACTOR
+    return max(RETRY_TIME_MIN, min(interval, RETRY_TIME_MAX))
+
+
+def load_tenants(path):
+    """Загрузка реестра подписчиков из JSON-файла или базы SQLite."""
+    if path.endswith(SQLITE_SUFFIXES):
+        with sqlite3.connect(path) as connection:
+            rows = connection.execute(SELECT_TENANTS).fetchall()
+    else:
+        with open(path, encoding='utf-8') as file:
+            rows = [
+                (item['practicum_token'], item['chat_id'],
+                 item.get('digest_window', DIGEST_WINDOW))
+                for item in json.load(file)
+            ]
+    if not rows:
+        raise ValueError(TENANTS_EMPTY_ERROR.format(path=path))
+    return [Tenant(*row) for row in rows]
+
+
+def get_tenants():
+    """Подписчики из реестра либо единственный из переменных окружения."""
+    if TENANTS_FILE:
+        return load_tenants(TENANTS_FILE)
+    return [Tenant(PRACTICUM_TOKEN, TELEGRAM_CHAT_ID)]
+
+
+def ring_hash(value):
+    """Точка значения на кольце консистентного хеширования."""
+    return int(hashlib.sha256(str(value).encode()).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """Кольцо консистентного хеширования шардов.
+
+    Каждый шард занимает replicas точек кольца, ключ принадлежит шарду
+    ближайшей точки по часовой стрелке. При добавлении шарда к нему
+    переходит лишь около 1/N ключей, остальные остаются на месте.
+    """
+
+    def __init__(self, shards, replicas=HASH_REPLICAS):
+        """Точки кольца строятся один раз."""
+        points = sorted(
+            (ring_hash(f'shard-{shard}:{replica}'), shard)
+            for shard in range(shards)
+            for replica in range(replicas)
+        )
+        self.hashes = [point for point, _ in points]
+        self.shards = [shard for _, shard in points]
+
+    def owner(self, key):
+        """Шард, которому принадлежит ключ."""
+        index = bisect.bisect(self.hashes, ring_hash(key))
+        return self.shards[index % len(self.shards)]
+
+
+def shard_tenants(tenants, shard, shards):
+    """Подписчики шарда; чаты одного токена попадают в один шард."""
+    if shards == 1:
+        return tenants
+    ring = HashRing(shards)
+    return [
+        tenant for tenant in tenants
+        if ring.owner(tenant.practicum_token) == shard
+    ]
+
+
+class CircuitBreaker:
+    """Предохранитель запросов к API, общий для всех подписчиков.
+
+    После threshold временных ошибок подряд размыкается и отклоняет
+    запросы recovery_time секунд, затем пропускает не больше probes
+    пробных запросов: успешный замыкает его, неудачный снова размыкает.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=BREAKER_THRESHOLD,
+                 recovery_time=BREAKER_RECOVERY_TIME, probes=BREAKER_PROBES):
+        """Предохранитель создаётся замкнутым."""
+        self.threshold = threshold
+        self.recovery_time = recovery_time
+        self.probes = probes
+        self.state = self.CLOSED
+        self.failures = 0
+        self.retries = 0
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.lock = threading.Lock()
+
+    def switch(self, state):
+        """Смена состояния с записью в лог."""
+        logging.warning(BREAKER_STATE_MESSAGE.format(
+            old=self.state, new=state,
+            failures=self.failures, retries=self.retries
+        ))
+        self.state = state
+
+    def before_call(self):
+        """Разрешение на запрос либо CircuitOpenError.
+
+        Возвращает True, если запрос пропущен как пробный.
+        """
+        with self.lock:
+            if self.state == self.OPEN:
+                if CLOCK.monotonic() - self.opened_at < self.recovery_time:
+                    raise CircuitOpenError(
+                        CIRCUIT_OPEN_MESSAGE.format(failures=self.failures)
+                    )
+                self.switch(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self.probes_in_flight >= self.probes:
+                    raise CircuitOpenError(
+                        CIRCUIT_OPEN_MESSAGE.format(failures=self.failures)
+                    )
+                self.probes_in_flight += 1
+                return True
+            return False
+
+    def record(self, success, probe=False):
+        """Учёт результата запроса; probe — результат пробного запроса."""
+        with self.lock:
+            if probe:
+                self.probes_in_flight -= 1
+            if success:
+                self.failures = 0
+                if self.state != self.CLOSED:
+                    self.switch(self.CLOSED)
+                return
+            self.failures += 1
+            if (self.state == self.HALF_OPEN
+                    or self.failures >= self.threshold
+                    and self.state == self.CLOSED):
+                self.opened_at = CLOCK.monotonic()
+                self.switch(self.OPEN)
+
+    def call(self, function):
+        """Вызов запроса через предохранитель.
+
+        Постоянные ошибки (например, неверный токен) и ограничение
+        частоты означают, что API отвечает, и не размыкают предохранитель.
+        """
+        probe = self.before_call()
+        try:
+            result = function()
+        except Exception as error:
+            self.record(self.healthy(error), probe)
+            raise
+        self.record(True, probe)
+        return result
+
+    async def call_async(self, function):
+        """Вызов корутины запроса через предохранитель."""
+        probe = self.before_call()
+        try:
+            result = await function()
+        except Exception as error:
+            self.record(self.healthy(error), probe)
+            raise
+        self.record(True, probe)
+        return result
+
+    @staticmethod
+    def healthy(error):
+        """Отвечает ли API, несмотря на ошибку запроса."""
+        return not is_transient(error) or isinstance(error, ThrottledError)
+
+    def count_retry(self):
+        """Учёт повтора запроса."""
+        with self.lock:
+            self.retries += 1
+
+    def stats(self):
+        """Состояние предохранителя и счётчики."""
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'retries': self.retries,
+        }
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate жетонов в секунду, не больше capacity."""
+
+    def __init__(self, rate, capacity=None):
+        """Ведро создаётся полным."""
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = CLOCK.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        """Пополнение жетонов за прошедшее время."""
+        now = CLOCK.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def delay(self):
+        """Сколько секунд ждать до появления жетона."""
+        with self.lock:
+            self.refill()
+            return max(0, (1 - self.tokens) / self.rate)
+
+    def take(self):
+        """Получение жетона: 0 либо сколько секунд ждать его появления."""
+        with self.lock:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Ожидание и получение жетона."""
+        while True:
+            wait = self.take()
+            if not wait:
+                return
+            CLOCK.sleep(wait)
+
+    async def acquire_async(self):
+        """Ожидание жетона без блокировки цикла событий."""
+        while True:
+            wait = self.take()
+            if not wait:
+                return
+            await CLOCK.sleep_async(wait)
+
+
+class AdaptiveRateLimiter(TokenBucket):
+    """Общий лимит частоты запросов к API.
+
+    Каждый успешный ответ понемногу повышает лимит до max_rate,
+    ограничение со стороны API (429, Retry-After) вдвое снижает его
+    и приостанавливает все запросы на указанное API время.
+    """
+
+    def __init__(self, rate=API_RATE, min_rate=API_RATE_MIN, max_rate=None):
+        """Лимит начинается с rate запросов в секунду."""
+        super().__init__(rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate
+        self.paused_until = 0.0
+
+    def acquire(self):
+        """Ожидание окончания паузы и получение жетона."""
+        wait = self.paused_until - CLOCK.monotonic()
+        if wait > 0:
+            CLOCK.sleep(wait)
+        super().acquire()
+
+    async def acquire_async(self):
+        """Ожидание окончания паузы и жетона в цикле событий."""
+        wait = self.paused_until - CLOCK.monotonic()
+        if wait > 0:
+            await CLOCK.sleep_async(wait)
+        await super().acquire_async()
+
+    def succeed(self):
+        """Повышение лимита после успешного ответа."""
+        with self.lock:
+            self.refill()
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+
+    def throttle(self, retry_after=None):
+        """Снижение лимита и пауза после ограничения со стороны API.
+
+        Пауза не длиннее RETRY_AFTER_MAX: на ней ждут все потоки опроса,
+        и долгий Retry-After не должен задерживать их остановку.
+        """
+        with self.lock:
+            self.refill()
+            self.rate = max(self.min_rate, self.rate * RATE_DECREASE)
+            if retry_after:
+                self.paused_until = max(
+                    self.paused_until,
+                    CLOCK.monotonic() + min(retry_after, RETRY_AFTER_MAX)
+                )
+        logging.warning(RATE_LIMIT_MESSAGE.format(
+            rate=self.rate, retry_after=retry_after or 0
+        ))
+
+
+@dataclass
+class OutboxItem:
+    """Сообщение в очереди на отправку.
+
+    Если задан message_id, вместо отправки правится уже отправленное
+    сообщение; on_message получает id отправленного либо изменённого
+    сообщения. Новые сообщения с digest копятся digest секунд и
+    отправляются одним; элемент без текста — срок отправки накопленного.
+    on_failed вызывается, если от отправки пришлось отказаться; он
+    получает True, если ошибка Telegram постоянная и повтор бесполезен.
+    """
+
+    chat_id: str
+    text: str
+    on_sent: object = None
+    message_id: int = None
+    pin: bool = False
+    on_message: object = None
+    digest: float = 0.0
+    attempts: int = 0
+    on_failed: object = None
+
+
+def chain_callbacks(items, name):
+    """Вызов обработчика name у каждого из сообщений items."""
+    def call(*args):
+        for item in items:
+            callback = getattr(item, name)
+            if callback:
+                callback(*args)
+    return call
+
+
+def transmit(bot, item):
+    """Отправка сообщения либо правка отправленного; id сообщения.
+
+    Если сообщение для правки удалено или недоступно, отправляется новое;
+    новое сообщение с pin закрепляется без уведомления.
+    """
+    if item.message_id:
+        try:
+            METRICS.telegram_calls.inc('editMessageText')
+            bot.edit_message_text(
+                text=item.text, chat_id=item.chat_id,
+                message_id=item.message_id, timeout=TELEGRAM_READ_TIMEOUT
+            )
+            return item.message_id
+        except telegram.error.BadRequest as error:
+            if MESSAGE_NOT_MODIFIED in str(error).lower():
+                return item.message_id
+            logging.warning(EDIT_MESSAGE_ERROR.format(
+                message_id=item.message_id, error=error
+            ))
+    METRICS.telegram_calls.inc('sendMessage')
+    message_id = getattr(bot.send_message(
+        chat_id=item.chat_id, text=item.text, timeout=TELEGRAM_READ_TIMEOUT
+    ), 'message_id', None)
+    if item.pin and message_id:
+        try:
+            METRICS.telegram_calls.inc('pinChatMessage')
+            bot.pin_chat_message(
+                chat_id=item.chat_id, message_id=message_id,
+                disable_notification=True, timeout=TELEGRAM_READ_TIMEOUT
+            )
+        except telegram.error.TelegramError as error:
+            logging.warning(PIN_MESSAGE_ERROR.format(
+                message_id=message_id, error=error
+            ))
+    return message_id
+
+
+class Outbox:
+    """Очередь сообщений в Telegram с отдельным потоком отправки.
+
+    Частота отправки ограничена общим ведром жетонов и ведром на каждый
+    чат. Сообщения в чат, исчерпавший лимит, откладываются в порядке
+    поступления, не задерживая остальные чаты; при RetryAfter отправка
+    приостанавливается на время, указанное Telegram. Опрос API никогда
+    не ждёт отправки.
+
+    Сообщения с окном digest, пришедшие в чат в течение окна, объединяются
+    в одно; накопленное отправляется досрочно при переполнении и при
+    остановке очереди.
+    """
+
+    def __init__(self, bot, global_rate=TELEGRAM_GLOBAL_RATE,
+                 chat_rate=TELEGRAM_CHAT_RATE):
+        """Поток отправки запускается методом start."""
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_buckets = {}
+        self.buckets_lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.delayed = []
+        self.sequence = 0
+        self.digests = {}
+        self.waiting = {}
+        self.thread = None
+
+    def put(self, chat_id, text, on_sent=None, **options):
+        """Постановка сообщения в очередь; options — поля OutboxItem."""
+        self.queue.put(OutboxItem(chat_id, text, on_sent, **options))
+
+    def depth(self):
+        """Число сообщений, ожидающих отправки."""
+        return self.queue.qsize() + len(self.delayed) + sum(
+            len(waiting) - 1 for waiting in self.waiting.values()
+        )
+
+    def postpone(self, item, wait):
+        """Откладывание сообщения на wait секунд."""
+        self.sequence += 1
+        heapq.heappush(
+            self.delayed, (CLOCK.monotonic() + wait, self.sequence, item)
+        )
+
+    def next_item(self):
+        """Следующее сообщение, срок отправки которого наступил."""
+        while True:
+            now = CLOCK.monotonic()
+            if self.delayed and self.delayed[0][0] <= now:
+                return heapq.heappop(self.delayed)[2]
+            timeout = self.delayed[0][0] - now if self.delayed else None
+            try:
+                return self.queue.get(timeout=CLOCK.timeout(timeout))
+            except queue.Empty:
+                continue
+
+    def collect(self, item):
+        """Накопление сообщения в дайджест чата."""
+        pending = self.digests.setdefault(item.chat_id, [])
+        if pending and (
+            len(pending) >= DIGEST_MAX_ITEMS
+            or sum(len(other.text) for other in pending) + len(item.text)
+            > TELEGRAM_MESSAGE_LIMIT // 2
+        ):
+            self.send(self.merge(item.chat_id))
+            pending = self.digests.setdefault(item.chat_id, [])
+        pending.append(item)
+        if len(pending) == 1:
+            self.postpone(OutboxItem(item.chat_id, None), item.digest)
+
+    def merge(self, chat_id):
+        """Накопленные сообщения чата одним сообщением либо None."""
+        items = self.digests.pop(chat_id, None)
+        if not items:
+            return None
+        if len(items) == 1:
+            text = items[0].text
+        else:
+            text = DIGEST_MESSAGE.format(
+                count=len(items),
+                messages=DIGEST_SEPARATOR.join(item.text for item in items)
+            )
+
+        return OutboxItem(
+            chat_id, text, chain_callbacks(items, 'on_sent'),
+            on_message=chain_callbacks(items, 'on_message'),
+            on_failed=chain_callbacks(items, 'on_failed')
+        )
+
+    def chat_bucket(self, chat_id):
+        """Ведро жетонов чата, общее с ответами на команды."""
+        with self.buckets_lock:
+            key = str(chat_id)
+            if key not in self.chat_buckets:
+                self.chat_buckets[key] = TokenBucket(self.chat_rate, 1)
+            return self.chat_buckets[key]
+
+    def hold(self, item):
+        """True, если сообщение ждёт жетона своего чата.
+
+        Первое отложенное сообщение чата ждёт жетона в self.delayed,
+        остальные — за ним в self.waiting, чтобы правки и новые сообщения
+        чата не обгоняли друг друга.
+        """
+        waiting = self.waiting.get(item.chat_id)
+        if waiting and waiting[0] is not item:
+            waiting.append(item)
+            return True
+        wait = self.chat_bucket(item.chat_id).delay()
+        if wait > 0:
+            if not waiting:
+                self.waiting[item.chat_id] = deque([item])
+            self.postpone(item, wait)
+            return True
+        if waiting:
+            waiting.popleft()
+            if waiting:
+                self.postpone(waiting[0], 0)
+            else:
+                del self.waiting[item.chat_id]
+        return False
+
+    def send(self, item):
+        """Отправка сообщения с соблюдением лимитов Telegram."""
+        if item.text is None:
+            item = self.merge(item.chat_id)
+            if item is None:
+                return
+        elif item.digest and not (item.message_id or item.pin):
+            self.collect(item)
+            return
+        if self.hold(item):
+            return
+        self.global_bucket.acquire()
+        self.chat_bucket(item.chat_id).acquire()
+        started = time.monotonic()
+        try:
+            message_id = transmit(self.bot, item)
+        except telegram.error.RetryAfter as error:
+            logging.warning(RETRY_AFTER_MESSAGE.format(
+                seconds=error.retry_after, message=item.text
+            ))
+            self.postpone(item, error.retry_after)
+            CLOCK.sleep(error.retry_after)
+            return
+        except (telegram.error.TelegramError, Exception) as error:
+            self.fail(item, error)
+            return
+        METRICS.send_latency.observe(time.monotonic() - started)
+        logging.info(item.text)
+        if item.on_message:
+            item.on_message(message_id)
+        if item.on_sent:
+            item.on_sent()
+
+    def fail(self, item, error):
+        """Повтор сообщения после временной ошибки Telegram либо отказ."""
+        transient = isinstance(error, telegram.error.NetworkError) and not (
+            isinstance(error, telegram.error.BadRequest)
+        )
+        if transient and item.attempts < RETRY_ATTEMPTS:
+            item.attempts += 1
+            self.postpone(item, backoff_delay(item.attempts))
+            return
+        logging.error(SEND_MESSAGE_ERROR.format(
+            message=item.text, error=error
+        ))
+        if item.on_failed:
+            item.on_failed(isinstance(error, PERMANENT_TELEGRAM_ERRORS))
+
+    def flush(self):
+        """Отправка накопленных и отложенных сообщений."""
+        for chat_id in list(self.digests):
+            self.send(self.merge(chat_id))
+        while self.delayed:
+            ready_at, _, item = heapq.heappop(self.delayed)
+            if item.text is None:
+                continue
+            CLOCK.sleep(max(0, ready_at - CLOCK.monotonic()))
+            self.send(item)
+
+    def run(self):
+        """Отправка сообщений до получения None."""
+        while True:
+            item = self.next_item()
+            if item is None:
+                self.flush()
+                return
+            self.send(item)
+
+    def start(self):
+        """Запуск потока отправки."""
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """Остановка потока после отправки уже поставленных сообщений."""
+        self.queue.put(None)
+        if self.thread:
+            self.thread.join(timeout)
+
+
+class Watchdog:
+    """Сторож цикла опроса.
+
+    Цикл сообщает, сколько секунд он может не подавать признаков жизни;
+    если срок истёк, цикл считается зависшим и вызывается on_stall —
+    по умолчанию процесс завершается, чтобы его перезапустил супервизор.
+    """
+
+    def __init__(self, on_stall=None, period=WATCHDOG_PERIOD):
+        """Поток сторожа запускается методом start."""
+        self.on_stall = on_stall or partial(os._exit, WATCHDOG_EXIT_CODE)
+        self.period = period
+        self.alive_until = math.inf
+        self.beaten_at = time.monotonic()
+        self.stopped = threading.Event()
+
+    def beat(self, seconds):
+        """Цикл жив и подаст следующий сигнал не позже чем через seconds."""
+        self.beaten_at = time.monotonic()
+        self.alive_until = self.beaten_at + seconds + WATCHDOG_GRACE
+
+    def check(self):
+        """Проверка срока; True, если цикл завис."""
+        if time.monotonic() <= self.alive_until:
+            return False
+        logging.critical(WATCHDOG_MESSAGE.format(
+            seconds=time.monotonic() - self.beaten_at
+        ))
+        self.on_stall()
+        return True
+
+    def run(self):
+        """Периодическая проверка до остановки либо зависания цикла."""
+        while not self.stopped.wait(self.period):
+            if self.check():
+                return
+
+    def start(self):
+        """Запуск потока сторожа."""
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        """Остановка сторожа."""
+        self.stopped.set()
+
+
+class CommandServer:
+    """Ответы на команды подписчиков в Telegram.
+
+    Отдельный поток получает команды через long polling getUpdates
+    и отвечает по известному состоянию подписчиков, не обращаясь к API,
+    поэтому ответ не ждёт прохода опроса. Ответы проходят через общее
+    с очередью сообщений ведро жетонов Telegram bucket и ведро чата
+    из chat_bucket (например, Outbox.chat_bucket), если они переданы.
+    Состояние подписчиков из remote, которых опрашивают другие шарды,
+    читается из хранилища store.
+    """
+
+    def __init__(self, bot, tenants, bucket=None,
+                 timeout=COMMANDS_POLL_TIMEOUT, store=None, remote=(),
+                 chat_bucket=None):
+        """Поток получения команд запускается методом start."""
+        self.bot = bot
+        self.bucket = bucket
+        self.chat_bucket = chat_bucket
+        self.timeout = timeout
+        self.store = store
+        self.remote = {tenant.key for tenant in remote}
+        self.offset = None
+        self.stopped = threading.Event()
+        self.by_chat = {}
+        for tenant in tenants:
+            self.by_chat.setdefault(str(tenant.chat_id), []).append(tenant)
+        self.commands = {
+            '/status': self.status,
+            '/history': self.history,
+            '/next': self.next_poll,
+        }
+
+    def status(self, tenant, now):
+        """Последние известные статусы домашних работ."""
+        lines = [
+            COMMAND_STATUS_LINE.format(
+                name=tenant.titles.get(key, key),
+                verdict=HOMEWORK_VERDICTS.get(status, status)
+            )
+            for key, status in list(tenant.statuses.items())
+        ]
+        return '\n'.join(lines) or COMMAND_STATUS_EMPTY
+
+    def history(self, tenant, now):
+        """Последние изменения статусов, начиная с новых."""
+        lines = [
+            COMMAND_HISTORY_LINE.format(
+                time=time.strftime(COMMAND_TIME_FORMAT, time.localtime(at)),
+                name=name, verdict=HOMEWORK_VERDICTS.get(status, status)
+            )
+            for at, name, status in reversed(list(tenant.history))
+        ]
+        return '\n'.join(lines) or COMMAND_HISTORY_EMPTY
+
+    def next_poll(self, tenant, now):
+        """Время следующего опроса API."""
+        if not tenant.next_poll:
+            return COMMAND_NEXT_UNKNOWN
+        return COMMAND_NEXT_MESSAGE.format(
+            time=time.strftime(
+                COMMAND_TIME_FORMAT, time.localtime(tenant.next_poll)
+            ),
+            minutes=max(0, round((tenant.next_poll - now) / 60))
+        )
+
+    def answer(self, chat_id, text, now):
+        """Ответ на сообщение из чата."""
+        tenants = self.by_chat.get(str(chat_id))
+        if not tenants:
+            return COMMAND_NOT_SUBSCRIBED
+        words = text.split()
+        if not words:
+            return COMMAND_HELP
+        command = self.commands.get(words[0].split('@')[0].lower())
+        if command is None:
+            return COMMAND_HELP
+        for tenant in tenants:
+            if self.store and tenant.key in self.remote:
+                self.store.refresh(tenant)
+        return '\n\n'.join(command(tenant, now) for tenant in tenants)
+
+    def handle(self, update):
+        """Ответ на одно обновление Telegram."""
+        message = update.message
+        if message is None or not message.text:
+            return
+        started = time.monotonic()
+        reply = self.answer(message.chat_id, message.text, CLOCK.time())
+        if self.chat_bucket:
+            self.chat_bucket(message.chat_id).acquire()
+        if self.bucket:
+            self.bucket.acquire()
+        send_to_chat(self.bot, message.chat_id, reply)
+        METRICS.command_latency.observe(time.monotonic() - started)
+
+    def receive(self):
+        """Получение и обработка очередной пачки обновлений."""
+        try:
+            updates = self.bot.get_updates(
+                offset=self.offset, timeout=self.timeout,
+                allowed_updates=['message']
+            )
+        except (telegram.error.TelegramError, Exception) as error:
+            logging.error(COMMANDS_ERROR.format(error=error))
+            self.stopped.wait(COMMANDS_RETRY_DELAY)
+            return
+        for update in updates:
+            self.offset = update.update_id + 1
+            try:
+                self.handle(update)
+            except Exception as error:
+                logging.error(COMMAND_ERROR.format(
+                    update_id=update.update_id, error=error
+                ), exc_info=error)
+
+    def run(self):
+        """Получение команд до остановки."""
+        while not self.stopped.is_set():
+            self.receive()
+
+    def start(self):
+        """Запуск потока получения команд."""
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        """Остановка после текущего запроса getUpdates."""
+        self.stopped.set()
+
+
+class Scheduler:
+    """Расписание опросов на двоичной куче.
+
+    В куче лежат пары (время опроса, подписчик); перенос опроса —
+    добавление новой записи за O(log n), устаревшие записи
+    отбрасываются при извлечении. При создании опросы токенов равномерно
+    распределяются по spread секундам, при переносе интервал
+    получает случайный разброс ±jitter, чтобы опросы не собирались
+    в одни и те же моменты.
+    """
+
+    def __init__(self, tenants, spread=RETRY_TIME,
+                 jitter=SCHEDULE_JITTER):
+        """Первый токен опрашивается сразу, остальные — с шагом."""
+        self.jitter = jitter
+        self.heap = []
+        self.sequence = 0
+        self.lock = threading.Lock()
+        now = CLOCK.time()
+        slots = {}
+        for tenant in tenants:
+            slots.setdefault(tenant.practicum_token, len(slots))
+        for tenant in tenants:
+            self.push(tenant, now + spread * (
+                slots[tenant.practicum_token] / len(slots)
+            ))
+
+    def push(self, tenant, when):
+        """Назначение опроса подписчика на момент when."""
+        with self.lock:
+            tenant.next_poll = when
+            self.sequence += 1
+            heapq.heappush(self.heap, (when, self.sequence, tenant))
+
+    def reschedule(self, tenant, interval, now):
+        """Перенос опроса через interval секунд с разбросом.
+
+        Разброс зависит только от токена и from_date, поэтому чаты одного
+        токена остаются в одном слоте и разделяют запрос к API.
+        """
+        share = ring_hash(f'{tenant.practicum_token}:{tenant.timestamp}')
+        jitter = 1 + self.jitter * (2 * share / RING_SIZE - 1)
+        self.push(tenant, now + interval * jitter)
+
+    def discard_stale(self):
+        """Удаление устаревших записей с вершины кучи."""
+        while self.heap and self.heap[0][0] != self.heap[0][2].next_poll:
+            heapq.heappop(self.heap)
+
+    def pop_due(self, now):
+        """Извлечение подписчиков, срок опроса которых наступил."""
+        due = []
+        with self.lock:
+            self.discard_stale()
+            while self.heap and self.heap[0][0] <= now:
+                due.append(heapq.heappop(self.heap)[2])
+                self.discard_stale()
+        return due
+
+    def next_time(self):
+        """Время ближайшего опроса либо None, если расписание пусто."""
+        with self.lock:
+            self.discard_stale()
+            return self.heap[0][0] if self.heap else None
+
+
+@dataclass
+class Flight:
+    """Запрос к API, результат которого разделяют подписчики."""
+
+    event: threading.Event = field(default_factory=threading.Event)
+    result: object = None
+    error: Exception = None
+    done_at: float = 0.0
+    task: object = None
+
+
+class SingleFlight:
+    """Объединение одинаковых запросов к API.
+
+    Пока запрос с ключом выполняется, повторные вызовы ждут его
+    результата; успешный результат ещё window секунд отдаётся без
+    нового запроса. Ошибки не кэшируются.
+    """
+
+    def __init__(self, window=COALESCE_WINDOW):
+        """Счётчики попаданий ведутся с момента создания."""
+        self.window = window
+        self.pruned_at = CLOCK.monotonic()
+        self.flights = {}
+        self.calls = 0
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    def fresh(self, flight):
+        """Можно ли отдать результат запроса без нового."""
+        if not flight.event.is_set():
+            return True
+        return (
+            flight.error is None
+            and CLOCK.monotonic() - flight.done_at < self.window
+        )
+
+    def board(self, key):
+        """Запрос по ключу и признак, что его нужно выполнить заново."""
+        with self.lock:
+            self.calls += 1
+            flight = self.flights.get(key)
+            leader = flight is None or not self.fresh(flight)
+            if leader:
+                flight = self.flights[key] = Flight()
+            else:
+                self.hits += 1
+        if not leader:
+            METRICS.coalesced.inc()
+        return flight, leader
+
+    @staticmethod
+    def land(flight, result=None, error=None):
+        """Завершение запроса с результатом либо ошибкой."""
+        flight.result = result
+        flight.error = error
+        flight.done_at = CLOCK.monotonic()
+        flight.event.set()
+
+    @staticmethod
+    def outcome(flight):
+        """Результат завершённого запроса либо его ошибка."""
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def do(self, key, function):
+        """Результат function для ключа, не чаще одного запроса за раз."""
+        flight, leader = self.board(key)
+        if leader:
+            try:
+                self.land(flight, function())
+            except Exception as error:
+                self.land(flight, error=error)
+        else:
+            flight.event.wait()
+        return self.outcome(flight)
+
+    async def do_async(self, key, function):
+        """Асинхронный вариант do: function возвращает корутину.
+
+        Запрос выполняется отдельной задачей, поэтому отмена одного
+        из ожидающих не прерывает его для остальных.
+        """
+        flight, leader = self.board(key)
+        if leader:
+            flight.task = asyncio.ensure_future(self.fly(flight, function))
+        if not flight.event.is_set():
+            await asyncio.shield(flight.task)
+        return self.outcome(flight)
+
+    async def fly(self, flight, function):
+        """Выполнение корутины запроса с записью результата."""
+        try:
+            self.land(flight, await function())
+        except Exception as error:
+            self.land(flight, error=error)
+
+    def prune(self):
+        """Удаление завершённых запросов с истёкшим окном.
+
+        Запросы просматриваются не чаще раза в window секунд.
+        """
+        now = CLOCK.monotonic()
+        if now - self.pruned_at < self.window:
+            return
+        self.pruned_at = now
+        with self.lock:
+            for key in [
+                key for key, flight in self.flights.items()
+                if not self.fresh(flight)
+            ]:
+                del self.flights[key]
+
+    def hit_ratio(self):
+        """Доля вызовов, обслуженных без нового запроса."""
+        return self.hits / self.calls if self.calls else 0.0
+
+
+class PollingEngine:
+    """Опрос API для множества подписчиков ограниченным пулом потоков."""
+
+    recording_class = RecordingSession
+
+    def __init__(self, bot, tenants, workers=POLL_WORKERS, session=None,
+                 store=None, outbox=None, breaker=None, watchdog=None,
+                 deadline=CYCLE_DEADLINE, limiter=None,
+                 notify_mode=NOTIFY_MODE):
+        """Подписчики опрашиваются с сохранённого момента либо с текущего.
+
+        Если передана очередь outbox, сообщения отправляются через неё;
+        в режиме notify_mode='edit' статусы правят закреплённые сообщения.
+        """
+        self.bot = bot
+        self.tenants = tenants
+        self.workers = max(1, min(workers, len(tenants)))
+        self.session = session or self.make_client(self.workers)
+        self.store = store
+        self.outbox = outbox
+        self.outgoing = None
+        self.edit = notify_mode == 'edit'
+        self.breaker = breaker or CircuitBreaker()
+        self.limiter = limiter or AdaptiveRateLimiter()
+        METRICS.api_rate_limit.set_function(lambda: self.limiter.rate)
+        self.watchdog = watchdog
+        self.deadline = deadline
+        self.reported_at = 0.0
+        self.acked = []
+        self.pending = set()
+        self.redelivery_delay = REDELIVERY_TIME
+        self.redelivery_at = CLOCK.time() + self.redelivery_delay
+        if store:
+            store.load(tenants)
+        timestamp = int(CLOCK.time())
+        for tenant in tenants:
+            tenant.timestamp = tenant.timestamp or timestamp
+            tenant.changed_at = tenant.changed_at or timestamp
+        if store:
+            self.resend(store.pending())
+        self.scheduler = Scheduler(tenants)
+        self.flights = SingleFlight()
+        METRICS.coalesce_hit_ratio.set_function(self.flights.hit_ratio)
+
+    @staticmethod
+    def make_client(workers=POLL_WORKERS):
+        """Клиент API на workers одновременных запросов."""
+        return make_session(workers)
+
+    def fetch(self, tenant):
+        """Запрос к API от имени подписчика с повторами.
+
+        Подписчики с общим токеном и from_date разделяют один запрос.
+        """
+        return self.flights.do(
+            (tenant.practicum_token, tenant.timestamp),
+            partial(call_with_retries, partial(
+                request_api, tenant.timestamp, tenant.headers, self.session
+            ), self.breaker, self.limiter)
+        )
+
+    def process(self, tenant, response):
+        """Недоставленные сообщения для подписчика по ответу API.
+
+        Каждое сообщение возвращается вместе с домашней работой.
+        """
+        homeworks = check_response(response)
+        changes = diff_homeworks(tenant.statuses, homeworks)
+        messages = [
+            (homework, parse_status(homework))
+            for homework in changes
+            if homework_fingerprint(homework) not in tenant.delivered
+        ]
+        now = CLOCK.time()
+        for homework in changes:
+            key = homework_key(homework)
+            tenant.statuses[key] = homework['status']
+            tenant.titles[key] = homework.get('homework_name', key)
+            tenant.history.append(
+                (now, tenant.titles[key], homework['status'])
+            )
+        if changes:
+            tenant.status = homeworks[0]['status']
+            tenant.changed_at = now
+        tenant.timestamp = response.get('current_date', tenant.timestamp)
+        return messages
+
+    def recovered(self, tenant):
+        """Сообщение о восстановлении после ошибок либо None."""
+        if tenant.errors is None:
+            return None
+        return tenant.errors.recover()
+
+    def schedule(self, tenant):
+        """Назначение времени следующего опроса подписчика."""
+        now = CLOCK.time()
+        tenant.interval = poll_interval(tenant.status, tenant.changed_at, now)
+        self.scheduler.reschedule(tenant, tenant.interval, now)
+
+    def due(self):
+        """Подписчики, которых пора опросить.
+
+        Опросы, до срока которых меньше SCHEDULE_BATCH секунд, выполняются
+        в том же проходе, чтобы не будить цикл ради каждого подписчика.
+        """
+        return self.scheduler.pop_due(CLOCK.time() + SCHEDULE_BATCH)
+
+    def pause(self):
+        """Пауза до ближайшего запланированного опроса."""
+        next_poll = self.scheduler.next_time()
+        if next_poll is None:
+            return RETRY_TIME_MIN
+        return max(1, min(next_poll - CLOCK.time(), RETRY_TIME_MAX))
+
+    def beat(self, seconds):
+        """Сигнал сторожу, что цикл опроса жив."""
+        if self.watchdog:
+            self.watchdog.beat(seconds)
+
+    def cancel(self, tenants):
+        """Учёт подписчиков, опрос которых отменён по сроку прохода."""
+        now = CLOCK.time()
+        for tenant in tenants:
+            self.scheduler.push(tenant, now)
+        if tenants:
+            logging.warning(CYCLE_DEADLINE_MESSAGE.format(
+                deadline=self.deadline, count=len(tenants)
+            ))
+
+    def observe_cycle(self, tenants, started):
+        """Учёт прохода опроса в метриках."""
+        duration = time.monotonic() - started
+        METRICS.cycle_duration.observe(duration)
+        METRICS.polls.inc(amount=len(tenants))
+        METRICS.due_tenants.set(len(tenants))
+        if duration > 0:
+            METRICS.tenants_per_second.set(len(tenants) / duration)
+
+    def savings(self):
+        """Запросов в час при адаптивном и при фиксированном интервале."""
+        adaptive = sum(HOUR / tenant.interval for tenant in self.tenants)
+        return adaptive, len(self.tenants) * HOUR / RETRY_TIME
+
+    def report(self):
+        """Периодический отчёт об экономии запросов и состоянии API."""
+        now = CLOCK.time()
+        if now - self.reported_at < SAVINGS_REPORT_PERIOD:
+            return
+        self.reported_at = now
+        adaptive, fixed = self.savings()
+        logging.info(SAVINGS_MESSAGE.format(
+            adaptive=adaptive, fixed=fixed, saved=fixed - adaptive
+        ))
+        logging.info(BREAKER_STATS_MESSAGE.format(**self.breaker.stats()))
+
+    def failure(self, tenant, error):
+        """Текст ошибки для подписчика либо None, если её придержать."""
+        METRICS.errors.inc(type(error).__name__)
+        logging.error(
+            MAIN_EXCEPTION_MESSAGE.format(error=error), exc_info=error
+        )
+        if tenant.errors is None:
+            tenant.errors = ErrorAggregator()
+        return tenant.errors.record(error, CLOCK.time())
+
+    def deliver(self, tenant, message, on_sent=None, key=None, final=False,
+                on_failed=None):
+        """Отправка сообщения в чат подписчика.
+
+        on_sent вызывается после успешной отправки, on_failed — после
+        отказа от отправки. В режиме правки сообщение с ключом key правит
+        ранее отправленное по этому ключу; итоговый вердикт (final)
+        вдобавок приходит новым сообщением. Изменения статусов копятся
+        в дайджест, если у подписчика задано окно.
+        """
+        if self.outbox:
+            options = {}
+            if self.edit and key is not None:
+                options = self.edit_options(tenant, key, final)
+            if options.get('message_id') and final:
+                self.outbox.put(tenant.chat_id, message, **options)
+                options = {}
+            if key not in (None, ERRORS_KEY):
+                options['digest'] = tenant.digest_window
+            self.outbox.put(
+                tenant.chat_id, message, on_sent, on_failed=on_failed,
+                **options
+            )
+        elif send_to_chat(self.bot, tenant.chat_id, message):
+            if on_sent:
+                on_sent()
+        elif on_failed:
+            on_failed()
+
+    def edit_options(self, tenant, key, final):
+        """Параметры отправки сообщения в режиме правки.
+
+        Закреплённое сообщение работы правится при каждом изменении
+        статуса и остаётся за работой после итогового вердикта; служебное
+        сообщение об ошибках после восстановления больше не правится.
+        """
+        if final and key == ERRORS_KEY:
+            return {'on_message': partial(self.forget_message, tenant, key)}
+        return {
+            'message_id': tenant.message_ids.get(key),
+            'pin': key != ERRORS_KEY,
+            'on_message': partial(self.remember_message, tenant, key),
+        }
+
+    @staticmethod
+    def remember_message(tenant, key, message_id):
+        """Запоминание сообщения, которое правится по ключу."""
+        if message_id:
+            tenant.message_ids[key] = message_id
+
+    @staticmethod
+    def forget_message(tenant, key, message_id):
+        """Сообщение по ключу больше не правится."""
+        tenant.message_ids.pop(key, None)
+
+    def mark_delivered(self, tenant, fingerprint):
+        """Запоминание доставленного изменения статуса."""
+        now = CLOCK.time()
+        tenant.delivered[fingerprint] = now
+        for old in [
+            old for old, delivered_at in tenant.delivered.items()
+            if delivered_at < now - DELIVERED_TTL
+        ]:
+            del tenant.delivered[old]
+
+    def acknowledge(self, tenant, fingerprint):
+        """Подтверждение доставки: сообщение удаляется из outbox."""
+        self.mark_delivered(tenant, fingerprint)
+        key = outbox_key(tenant, fingerprint)
+        self.pending.discard(key)
+        if self.store:
+            self.acked.append(key)
+
+    def release(self, tenant, fingerprint, permanent=False):
+        """Отказ от отправки.
+
+        После временных ошибок сообщение ждёт повтора из outbox, после
+        постоянной (бот заблокирован, чат не найден) удаляется из него.
+        """
+        key = outbox_key(tenant, fingerprint)
+        self.pending.discard(key)
+        if permanent and self.store:
+            self.acked.append(key)
+
+    def acknowledged(self):
+        """Ключи сообщений, удаляемых из outbox при сохранении."""
+        acked, self.acked = self.acked, []
+        return acked
+
+    def resend(self, rows):
+        """Повторная отправка сообщений, не подтверждённых до перезапуска.
+
+        Сообщение, доставка которого уже сохранена, только подтверждается,
+        а уже ждущее отправки повторно не ставится в очередь. Возвращает
+        число сообщений, поставленных в очередь.
+        """
+        tenants = {tenant.key: tenant for tenant in self.tenants}
+        count = 0
+        for key, tenant_key, fingerprint, message in rows:
+            tenant = tenants.get(tenant_key)
+            if tenant is None or key in self.pending:
+                continue
+            if fingerprint in tenant.delivered:
+                self.acked.append(key)
+                continue
+            self.pending.add(key)
+            count += 1
+            self.deliver(
+                tenant, message,
+                partial(self.acknowledge, tenant, fingerprint),
+                on_failed=partial(self.release, tenant, fingerprint)
+            )
+        return count
+
+    def redeliver(self):
+        """Периодический повтор сообщений, от отправки которых отказались.
+
+        Пока в outbox остаются неотправленные сообщения, пауза между
+        повторами удваивается до REDELIVERY_TIME_MAX.
+        """
+        now = CLOCK.time()
+        if not self.store or now < self.redelivery_at:
+            return
+        if self.resend(self.store.pending()):
+            self.redelivery_delay = min(
+                2 * self.redelivery_delay, REDELIVERY_TIME_MAX
+            )
+        else:
+            self.redelivery_delay = REDELIVERY_TIME
+        self.redelivery_at = now + self.redelivery_delay
+
+    def notify(self, tenant, messages):
+        """Отправка сообщений об изменениях статусов.
+
+        Сообщения сначала записываются в outbox хранилища. В цикле опроса
+        запись откладывается до сохранения состояния прохода (save),
+        чтобы проход стоил одну транзакцию; вне цикла выполняется сразу.
+        """
+        if self.outgoing is not None:
+            self.outgoing.append((tenant, messages))
+            return
+        notices = self.prepare([(tenant, messages)])
+        if self.store and notices:
+            self.store.enqueue(outbox_rows(notices, CLOCK.time()))
+        self.dispatch(notices)
+
+    def prepare(self, batch):
+        """Изменения из пар (подписчик, сообщения), ещё не ждущие отправки.
+
+        Возвращает четвёрки (подписчик, работа, отпечаток, сообщение);
+        их ключи отмечаются как ожидающие отправки.
+        """
+        notices = []
+        for tenant, messages in batch:
+            for homework, message in messages:
+                fingerprint = homework_fingerprint(homework)
+                key = outbox_key(tenant, fingerprint)
+                if key not in self.pending:
+                    self.pending.add(key)
+                    notices.append((tenant, homework, fingerprint, message))
+        return notices
+
+    def dispatch(self, notices):
+        """Постановка в очередь сообщений, записанных в outbox."""
+        for tenant, homework, fingerprint, message in notices:
+            self.deliver(
+                tenant, message,
+                partial(self.acknowledge, tenant, fingerprint),
+                homework_key(homework),
+                homework['status'] in TERMINAL_STATUSES,
+                partial(self.release, tenant, fingerprint)
+            )
+
+    def drain(self):
+        """Пары (подписчик, сообщения), накопленные с прошлого сохранения."""
+        batch = []
+        while self.outgoing:
+            batch.append(self.outgoing.popleft())
+        return batch
+
+    def notify_error(self, tenant, message, final=False):
+        """Отправка сообщения об ошибке либо о восстановлении (final)."""
+        if message:
+            self.deliver(tenant, message, key=ERRORS_KEY, final=final)
+
+    def save(self, tenants):
+        """Сохранение состояния опрошенных подписчиков.
+
+        Накопленные за проход сообщения записываются в outbox той же
+        транзакцией и отправляются после неё.
+        """
+        self.flights.prune()
+        notices = self.prepare(self.drain())
+        acknowledged = self.acknowledged()
+        if self.store and (tenants or acknowledged or notices):
+            self.store.save(
+                tenants, acknowledged, outbox_rows(notices, CLOCK.time())
+            )
+        self.dispatch(notices)
+        self.redeliver()
+
+    def poll(self, tenant):
+        """Один цикл опроса API для подписчика."""
+        try:
+            messages = self.process(tenant, self.fetch(tenant))
+        except Exception as error:
+            self.notify_error(tenant, self.failure(tenant, error))
+        else:
+            self.notify_error(tenant, self.recovered(tenant), True)
+            self.notify(tenant, messages)
+        finally:
+            self.schedule(tenant)
+
+    def run_cycle(self, executor, tenants=None):
+        """Опрос подписчиков одним проходом, по умолчанию всех.
+
+        Опросы, не начатые за deadline секунд, отменяются; начатые
+        ограничены таймаутами запросов и до завершения не назначаются
+        повторно.
+        """
+        if tenants is None:
+            tenants = self.tenants
+        futures = {
+            executor.submit(self.poll, tenant): tenant for tenant in tenants
+        }
+        _, not_done = wait(futures, timeout=self.deadline)
+        self.cancel([
+            futures[future] for future in not_done if future.cancel()
+        ])
+
+    def run_forever(self, until=None):
+        """Опрос подписчиков по мере наступления их срока.
+
+        Опрос бесконечен либо идёт до момента until.
+        """
+        logging.info(TENANTS_LOADED_MESSAGE.format(
+            count=len(self.tenants), workers=self.workers
+        ))
+        self.outgoing = deque() if self.store else None
+        with CLOCK.executor(self.workers) as executor:
+            while until is None or CLOCK.time() < until:
+                self.beat(self.deadline)
+                tenants = self.due()
+                started = time.monotonic()
+                self.run_cycle(executor, tenants)
+                self.observe_cycle(tenants, started)
+                self.save(tenants)
+                self.report()
+                pause = self.pause()
+                self.beat(pause)
+                CLOCK.sleep(pause)
+
+
+class AsyncPollingEngine(PollingEngine):
+    """Опрос API в одном цикле событий asyncio.
+
+    Запросы к Практикуму идут через асинхронный клиент aiohttp, их число
+    ограничено семафором. В пуле потоков выполняются только блокирующие
+    вызовы telegram и записи в хранилище, поэтому ожидание ответа API
+    не занимает потоков и не задерживает отправку сообщений.
+    """
+
+    recording_class = AsyncRecordingSession
+
+    def __init__(self, bot, tenants, concurrency=ASYNC_CONCURRENCY,
+                 session=None, store=None, outbox=None, breaker=None,
+                 watchdog=None, deadline=CYCLE_DEADLINE, limiter=None,
+                 notify_mode=NOTIFY_MODE):
+        """Семафор и пул потоков создаются при запуске цикла."""
+        super().__init__(
+            bot, tenants, concurrency, session, store, outbox, breaker,
+            watchdog, deadline, limiter, notify_mode
+        )
+        self.semaphore = None
+        self.executor = None
+
+    @staticmethod
+    def make_client(workers=ASYNC_CONCURRENCY):
+        """Асинхронный клиент API на workers одновременных запросов."""
+        return AsyncSession(workers)
+
+    async def fetch_async(self, tenant):
+        """Запрос к API от имени подписчика с повторами.
+
+        Подписчики с общим токеном и from_date разделяют один запрос.
+        """
+        return await self.flights.do_async(
+            (tenant.practicum_token, tenant.timestamp),
+            partial(call_with_retries_async, partial(
+                request_api_async, tenant.timestamp, tenant.headers,
+                self.session
+            ), self.breaker, self.limiter)
+        )
+
+    async def call(self, function, *args):
+        """Вызов блокирующей функции в пуле потоков."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, function, *args)
+
+    async def poll_async(self, tenant):
+        """Один цикл опроса API для подписчика."""
+        try:
+            async with self.semaphore:
+                response = await self.fetch_async(tenant)
+            messages = self.process(tenant, response)
+        except Exception as error:
+            message = self.failure(tenant, error)
+            if message:
+                await self.call(self.notify_error, tenant, message)
+        else:
+            message = self.recovered(tenant)
+            if message:
+                await self.call(self.notify_error, tenant, message, True)
+            if messages:
+                await self.call(self.notify, tenant, messages)
+        self.schedule(tenant)
+
+    async def run_cycle_async(self, tenants=None):
+        """Опрос подписчиков одним проходом, по умолчанию всех."""
+        if tenants is None:
+            tenants = self.tenants
+        if not tenants:
+            return
+        tasks = {
+            asyncio.ensure_future(self.poll_async(tenant)): tenant
+            for tenant in tenants
+        }
+        _, pending = await asyncio.wait(tasks, timeout=self.deadline)
+        for task in pending:
+            task.cancel()
+        self.cancel([tasks[task] for task in pending])
+
+    async def serve(self, until=None):
+        """Опрос подписчиков до момента until либо бесконечно."""
+        logging.info(TENANTS_LOADED_MESSAGE.format(
+            count=len(self.tenants), workers=self.workers
+        ))
+        self.semaphore = asyncio.Semaphore(self.workers)
+        self.outgoing = deque() if self.store else None
+        with CLOCK.executor(min(self.workers, POLL_WORKERS)) as executor:
+            self.executor = executor
+            try:
+                while until is None or CLOCK.time() < until:
+                    self.beat(self.deadline)
+                    tenants = self.due()
+                    started = time.monotonic()
+                    await self.run_cycle_async(tenants)
+                    self.observe_cycle(tenants, started)
+                    await self.call(self.save, tenants)
+                    self.report()
+                    pause = self.pause()
+                    self.beat(pause)
+                    await CLOCK.sleep_async(pause)
+            finally:
+                if isinstance(
+                    self.session, (AsyncSession, AsyncRecordingSession)
+                ):
+                    await self.session.close()
+
+    def run_forever(self, until=None):
+        """Запуск цикла событий."""
+        asyncio.run(self.serve(until))
+
+
+class Backfill:
+    """Загрузка истории домашних работ в хранилище без уведомлений.
+
+    API фильтрует работы только по from_date, поэтому история токена
+    читается одним потоковым запросом с момента since. Токены
+    обрабатываются частями по chunk, внутри части — параллельно, не больше
+    concurrency запросов сразу и через общий ограничитель частоты. Каждая
+    завершённая часть сохраняется и отмечается в хранилище, поэтому
+    прерванная загрузка продолжается с первой незавершённой части.
+    """
+
+    def __init__(self, store, since=0, concurrency=BACKFILL_CONCURRENCY,
+                 chunk=BACKFILL_CHUNK, session=None, breaker=None,
+                 limiter=None):
+        """Сессия, предохранитель и ограничитель общие для всех токенов."""
+        self.store = store
+        self.since = since
+        self.concurrency = concurrency
+        self.chunk = chunk
+        self.session = session or make_session(concurrency)
+        self.breaker = breaker or CircuitBreaker()
+        self.limiter = limiter or AdaptiveRateLimiter()
+
+    def fetch(self, headers):
+        """Последние статусы и названия работ и момент ответа API."""
+        fields, statuses, titles = {}, {}, {}
+        for homework in iter_changes(statuses, stream_api(
+            self.since, headers, fields, self.session
+        )):
+            key = homework_key(homework)
+            statuses[key] = homework['status']
+            titles[key] = homework.get('homework_name', key)
+        return statuses, titles, fields.get(
+            'current_date', int(CLOCK.time())
+        )
+
+    def sync(self, tenants):
+        """Загрузка истории токена в состояние всех его чатов."""
+        statuses, titles, current_date = call_with_retries(
+            partial(self.fetch, tenants[0].headers), self.breaker, self.limiter
+        )
+        for tenant in tenants:
+            tenant.statuses = dict(statuses)
+            tenant.titles = dict(titles)
+            tenant.status = next(iter(statuses.values()), tenant.status)
+            tenant.timestamp = current_date
+            tenant.changed_at = CLOCK.time()
+
+    def run_chunk(self, executor, groups):
+        """Загрузка части токенов; подписчики успешно загруженных."""
+        futures = {
+            executor.submit(self.sync, tenants): tenants for tenants in groups
+        }
+        done = []
+        for future, tenants in futures.items():
+            try:
+                future.result()
+            except Exception as error:
+                METRICS.errors.inc(type(error).__name__)
+                logging.error(BACKFILL_ERROR.format(error=error))
+            else:
+                done.extend(tenants)
+        return done
+
+    def run(self, tenants):
+        """Загрузка истории подписчиков, ещё не загруженных ранее."""
+        self.store.load(tenants)
+        finished = self.store.backfilled()
+        groups = {}
+        for tenant in tenants:
+            if tenant.key not in finished:
+                groups.setdefault(tenant.practicum_token, []).append(tenant)
+        groups = list(groups.values())
+        loaded = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for start in range(0, len(groups), self.chunk):
+                done = self.run_chunk(
+                    executor, groups[start:start + self.chunk]
+                )
+                self.store.save(done)
+                self.store.checkpoint([tenant.key for tenant in done])
+                loaded += len(done)
+                logging.info(BACKFILL_MESSAGE.format(
+                    loaded=loaded, total=sum(map(len, groups))
+                ))
+        return loaded
+
+
+ENGINES = {'threads': PollingEngine, 'asyncio': AsyncPollingEngine}
+
+
+def main(shard=0, shards=1, until=None):
+    """Основная логика работы бота.
+
+    При нескольких шардах процесс опрашивает только подписчиков шарда,
+    а на команды отвечает нулевой шард. Если задан until, бот
+    останавливается в этот момент по часам CLOCK.
+    """
     if not check_tokens():
         raise ValueError(TOKENS_ERROR)
-    bot = telegram.Bot(token=TELEGRAM_TOKEN)
-    timestamp = int(time.time())
-    old_message = ''
-    while True:
+    everyone = get_tenants()
+    tenants = shard_tenants(everyone, shard, shards)
+    logging.info(SHARD_STARTED_MESSAGE.format(
+        shard=shard, shards=shards, count=len(tenants)
+    ))
+    bot = telegram.Bot(
+        token=TELEGRAM_TOKEN,
+        request=Request(
+            con_pool_size=2 * min(
+                max(POLL_WORKERS, ASYNC_CONCURRENCY), len(tenants) or 1
+            ),
+            connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+            read_timeout=TELEGRAM_READ_TIMEOUT
+        )
+    )
+    engine_class = ENGINES.get(POLL_MODE, PollingEngine)
+    session, recorder = None, None
+    if RECORD_FILE:
+        recorder = Recorder(
+            RECORD_FILE if shards == 1 else f'{RECORD_FILE}.{shard}'
+        )
+        recorder.tenants(tenants)
+        bot = RecordingBot(bot, recorder)
+        session = engine_class.recording_class(
+            engine_class.make_client(), recorder
+        )
+    store = StateStore(STATE_DB) if STATE_DB else None
+    outbox = Outbox(bot)
+    outbox.start()
+    METRICS.outbox_depth.set_function(outbox.depth)
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT + shard, METRICS)
+    watchdog = Watchdog()
+    watchdog.start()
+    local = set(map(id, tenants))
+    commands = CommandServer(
+        bot, everyone, outbox.global_bucket, store=store,
+        remote=[tenant for tenant in everyone if id(tenant) not in local],
+        chat_bucket=outbox.chat_bucket
+    )
+    if COMMANDS_POLL_TIMEOUT and shard == 0:
+        commands.start()
+    signal.signal(signal.SIGTERM, stop_on_signal)
+    engine = engine_class(
+        bot, tenants, session=session, store=store, outbox=outbox,
+        watchdog=watchdog
+    )
+    try:
+        engine.run_forever(until)
+    finally:
+        commands.stop()
+        watchdog.stop()
+        outbox.stop(SHUTDOWN_TIMEOUT)
+        engine.save(tenants)
+        if recorder:
+            recorder.close()
+
+
+def lock_shard(shard):
+    """Захват файла-блокировки шарда; ждёт завершения прежнего владельца."""
+    lock = open(
+        os.path.join(SHARD_LOCK_DIR, SHARD_LOCK_FILE.format(shard=shard)), 'w'
+    )
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    lock.write(str(os.getpid()))
+    lock.flush()
+    return lock
+
+
+def run_shard(shard, shards):
+    """Процесс шарда: опрос подписчиков, назначенных шарду.
+
+    Процесс завершается через os._exit без обработчиков atexit, поэтому
+    поток записи лога останавливается здесь, дописывая очередь.
+    """
+    listener = setup_logging(f'{LOG_FILE}.{shard}')
+    try:
+        lock = lock_shard(shard)
         try:
-            response = get_api_answer(timestamp)
-            homeworks = check_response(response)
-            if len(homeworks) != 0:
-                send_message(bot, parse_status(homeworks[0]))
-            timestamp = response.get('current_date', timestamp)
-        except Exception as error:
-            message = MAIN_EXCEPTION_MESSAGE.format(error=error)
-            logging.exception(message)
-            if message != old_message:
-                if send_message(bot, message):
-                    old_message = message
-        time.sleep(RETRY_TIME)
+            main(shard, shards)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            lock.close()
+    finally:
+        listener.stop()
 
 
 if __name__ == '__main__':
-    logging.basicConfig(
-        format=(
-            '%(asctime)s - %(levelname)s '
-            '- %(funcName)s - %(lineno)d - %(message)s'
-        ),
-        handlers=[logging.FileHandler(filename=(__file__ + '.log')),
-                  logging.StreamHandler(stream=sys.stdout)],
-        level=logging.DEBUG)
-    main()
+    setup_logging()
+    if sys.argv[1:2] == ['backfill']:
+        Backfill(
+            StateStore(STATE_DB), int(sys.argv[2]) if sys.argv[2:] else 0
+        ).run(get_tenants())
+    elif SHARDS > 1:
+        Supervisor(SHARDS, run_shard).run()
+    else:
+        main()
@@ -0,0 +1,95 @@
+"""Разбор JSON из потока частей без чтения его целиком в память."""
+import codecs
+import json
+
+JSON_WHITESPACE = ' \t\r\n'
+JSON_DELIMITERS = JSON_WHITESPACE + ',:]}'
+STREAM_SYNTAX_ERROR = (
+    'Ошибка разбора JSON: ожидался один из символов {expected!r}, '
+    'получен {char!r}'
+)
+
+
+class JSONStreamReader:
+    """Разбор JSON из потока частей по одному значению.
+
+    В памяти держится только ещё не разобранный хвост прочитанных частей.
+    """
+
+    def __init__(self, chunks):
+        """Части текста JSON в байтах читаются по мере разбора."""
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.parser = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+
+    def fill(self):
+        """Чтение следующей части; False, если поток закончился."""
+        if self.eof:
+            return False
+        chunk = next(self.chunks, None)
+        self.eof = chunk is None
+        self.buffer = self.buffer[self.position:] + self.decoder.decode(
+            chunk or b'', final=self.eof
+        )
+        self.position = 0
+        return True
+
+    def peek(self):
+        """Следующий значащий символ либо пустая строка в конце потока."""
+        while True:
+            while (
+                self.position < len(self.buffer)
+                and self.buffer[self.position] in JSON_WHITESPACE
+            ):
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.fill():
+                return ''
+
+    def expect(self, expected):
+        """Пропуск одного из ожидаемых символов разметки."""
+        char = self.peek()
+        if not char or char not in expected:
+            raise ValueError(STREAM_SYNTAX_ERROR.format(
+                expected=expected, char=char
+            ))
+        self.position += 1
+        return char
+
+    def value(self):
+        """Очередное значение JSON целиком.
+
+        Значение, за которым в прочитанном нет разделителя, может быть
+        неполным: из "1." и "1e" разбирается только 1. Поэтому оно
+        принимается, лишь когда за ним следует разделитель, либо в конце
+        потока.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.parser.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            if (
+                end < len(self.buffer) and self.buffer[end] in JSON_DELIMITERS
+                or not self.fill()
+            ):
+                self.position = end
+                return value
+
+    def items(self):
+        """Элементы массива по одному."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.position += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
@@ -0,0 +1,158 @@
+"""Логирование через очередь с фоновым потоком записи."""
+import atexit
+import json
+import logging
+import math
+import queue
+import re
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_TEXT_FORMAT = (
+    '%(asctime)s - %(levelname)s '
+    '- %(funcName)s - %(lineno)d - %(message)s'
+)
+LOG_QUEUE_SIZE = 10000
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+TRACEBACK_WINDOW = 300
+TRACEBACK_SIGNATURES = 1000
+NUMBERS = re.compile(r'0x[0-9a-fA-F]+|\d+')
+
+
+def error_signature(error):
+    """Сигнатура ошибки: тип и текст без чисел и адресов объектов."""
+    return f'{type(error).__name__}: {NUMBERS.sub("N", str(error))}'
+
+
+class SecretFilter(logging.Filter):
+    """Маскирование секретов в сообщениях и трассировках лога."""
+
+    def __init__(self, redact):
+        """Функция redact получает текст и возвращает его без секретов."""
+        super().__init__()
+        self.redact = redact
+
+    def filter(self, record):
+        """Сообщение и трассировка форматируются и маскируются сразу."""
+        record.msg = self.redact(record.getMessage())
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.redact(
+                logging.Formatter().formatException(record.exc_info)
+            )
+            record.exc_info = None
+        return True
+
+
+class TracebackRateFilter(logging.Filter):
+    """Одна трассировка на одинаковую ошибку за window секунд.
+
+    Ошибки сравниваются по error_signature, поэтому отличия в from_date
+    и адресах объектов не делают ошибку новой. Повторы пишутся в лог
+    одной строкой, без трассировки.
+    """
+
+    def __init__(self, window=TRACEBACK_WINDOW):
+        """Время последней трассировки хранится по сигнатуре ошибки."""
+        super().__init__()
+        self.window = window
+        self.logged = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        """Удаление трассировки у повторной ошибки."""
+        if not record.exc_info:
+            return True
+        error = record.exc_info[1]
+        signature = error_signature(error)
+        now = time.monotonic()
+        with self.lock:
+            if now - self.logged.get(signature, -math.inf) < self.window:
+                record.exc_info = None
+                return True
+            if len(self.logged) >= TRACEBACK_SIGNATURES:
+                self.logged.clear()
+            self.logged[signature] = now
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной строкой JSON."""
+
+    def format(self, record):
+        """Поля записи в JSON."""
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'function': record.funcName,
+            'line': record.lineno,
+            'message': record.getMessage(),
+        }
+        if record.exc_text:
+            data['traceback'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Передача записей в очередь без ожидания.
+
+    Если очередь переполнена, запись отбрасывается: запись лога
+    не должна задерживать основную работу программы.
+    """
+
+    def __init__(self, log_queue):
+        """Счётчик отброшенных записей начинается с нуля."""
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        """Постановка записи в очередь либо её отбрасывание."""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        """Трассировка уже отформатирована фильтрами."""
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging(log_file, level=logging.DEBUG, json_format=False,
+                  max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT,
+                  redact=None):
+    """Логирование через очередь и фоновый поток записи.
+
+    Файл лога ротируется по размеру, формат строк — текст либо JSON.
+    Если передана функция redact, ею маскируются сообщения и трассировки.
+    Возвращает запущенный QueueListener.
+    """
+    if json_format:
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(LOG_TEXT_FORMAT)
+    handlers = [
+        RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count,
+            encoding='utf-8'
+        ),
+        logging.StreamHandler(stream=sys.stdout),
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(TracebackRateFilter())
+    if redact is not None:
+        queue_handler.addFilter(SecretFilter(redact))
+    logger = logging.getLogger()
+    logger.handlers = [queue_handler]
+    logger.setLevel(level)
+    listener = QueueListener(log_queue, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
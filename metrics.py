@@ -0,0 +1,137 @@
+"""Метрики в текстовом формате Prometheus и HTTP-сервер для них."""
+import bisect
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Counter:
+    """Счётчик Prometheus, возможно с одной меткой."""
+
+    kind = 'counter'
+
+    def __init__(self, name, description, label=None):
+        """Значения хранятся по значению метки."""
+        self.name = name
+        self.description = description
+        self.label = label
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, label_value=None, amount=1):
+        """Увеличение счётчика."""
+        with self.lock:
+            self.values[label_value] = (
+                self.values.get(label_value, 0) + amount
+            )
+
+    def samples(self):
+        """Строки значений в формате Prometheus."""
+        with self.lock:
+            values = list(self.values.items())
+        for label_value, value in values:
+            labels = (
+                f'{{{self.label}="{label_value}"}}' if self.label else ''
+            )
+            yield f'{self.name}{labels} {value}'
+
+
+class Gauge:
+    """Текущее значение либо функция, вычисляемая при чтении метрик."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, description):
+        """Значение по умолчанию — ноль."""
+        self.name = name
+        self.description = description
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        """Запись значения."""
+        self.value = value
+
+    def set_function(self, function):
+        """Значение будет вычисляться функцией при чтении метрик."""
+        self.function = function
+
+    def samples(self):
+        """Строка значения в формате Prometheus."""
+        value = self.function() if self.function else self.value
+        yield f'{self.name} {value}'
+
+
+class Histogram:
+    """Гистограмма Prometheus с заранее выделенными корзинами."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS):
+        """Корзины задаются верхними границами по возрастанию."""
+        self.name = name
+        self.description = description
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        """Учёт наблюдения."""
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self):
+        """Строки корзин, суммы и количества в формате Prometheus."""
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = 0
+        for bound, count in zip(self.bounds + ('+Inf',), counts):
+            cumulative += count
+            yield f'{self.name}_bucket{{le="{bound}"}} {cumulative}'
+        yield f'{self.name}_sum {total}'
+        yield f'{self.name}_count {cumulative}'
+
+
+class Registry:
+    """Набор метрик в атрибутах экземпляра, отдаваемый одним текстом."""
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus."""
+        lines = []
+        for metric in vars(self).values():
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Отдача метрик реестра сервера по HTTP."""
+
+    def do_GET(self):
+        """Ответ с текущими метриками."""
+        body = self.server.registry.render().encode()
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', METRICS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Запросы метрик не пишутся в лог."""
+
+
+def start_metrics_server(port, registry):
+    """Запуск HTTP-сервера метрик реестра registry в фоновом потоке."""
+    server = ThreadingHTTPServer(('', port), MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,113 @@
+"""Процессы-шарды с перезапуском упавших."""
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+
+SUPERVISOR_PERIOD = 1
+SHUTDOWN_TIMEOUT = 30
+SHARD_RESTART_DELAY = 1
+SHARD_RESTART_DELAY_MAX = 5 * 60
+SHARD_RESTARTS = 10
+SHARD_STABLE_TIME = 10 * 60
+SHARD_RESTART_MESSAGE = (
+    'Шард {shard} завершился с кодом {code}, перезапуск через {delay} с'
+)
+SHARD_GIVE_UP_MESSAGE = (
+    'Шард {shard} завершился с кодом {code} {count} раз подряд, '
+    'перезапуски прекращены'
+)
+SHARDS_STOPPED_ERROR = 'Все шарды остановлены после повторных падений'
+
+
+def stop_on_signal(signum, frame):
+    """Завершение по SIGTERM так же, как по Ctrl+C."""
+    raise KeyboardInterrupt
+
+
+class Supervisor:
+    """Процессы-шарды с перезапуском упавших.
+
+    Каждый шард — процесс target(shard, shards). Завершившийся процесс
+    перезапускается с тем же номером. Повторные падения перезапускаются
+    с удваивающейся паузой, а после SHARD_RESTARTS падений подряд шард
+    больше не перезапускается; счёт падений сбрасывается, если шард
+    проработал SHARD_STABLE_TIME.
+    """
+
+    def __init__(self, shards, target, period=SUPERVISOR_PERIOD):
+        """Процессы запускаются методом run."""
+        self.shards = shards
+        self.target = target
+        self.period = period
+        self.processes = {}
+        self.started = {}
+        self.failures = {}
+        self.restart_at = {}
+        self.stopped = threading.Event()
+
+    def spawn(self, shard):
+        """Запуск процесса шарда."""
+        process = multiprocessing.Process(
+            target=self.target, args=(shard, self.shards),
+            name=f'shard-{shard}'
+        )
+        process.start()
+        self.processes[shard] = process
+        self.started[shard] = time.monotonic()
+
+    def backoff(self, shard, code, now):
+        """Пауза перед перезапуском шарда либо None, если он брошен."""
+        if now - self.started[shard] >= SHARD_STABLE_TIME:
+            self.failures[shard] = 0
+        failures = self.failures[shard] = self.failures.get(shard, 0) + 1
+        if failures > SHARD_RESTARTS:
+            logging.critical(SHARD_GIVE_UP_MESSAGE.format(
+                shard=shard, code=code, count=failures
+            ))
+            return None
+        delay = 0 if failures == 1 else min(
+            SHARD_RESTART_DELAY * 2 ** (failures - 2), SHARD_RESTART_DELAY_MAX
+        )
+        logging.error(SHARD_RESTART_MESSAGE.format(
+            shard=shard, code=code, delay=delay
+        ))
+        return delay
+
+    def check(self):
+        """Перезапуск завершившихся процессов, когда истекла их пауза."""
+        now = time.monotonic()
+        for shard, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+            if shard not in self.restart_at:
+                delay = self.backoff(shard, process.exitcode, now)
+                if delay is None:
+                    del self.processes[shard]
+                    continue
+                self.restart_at[shard] = now + delay
+            if now >= self.restart_at[shard]:
+                del self.restart_at[shard]
+                self.spawn(shard)
+
+    def run(self):
+        """Запуск шардов и надзор за ними до остановки."""
+        signal.signal(signal.SIGTERM, stop_on_signal)
+        for shard in range(self.shards):
+            self.spawn(shard)
+        try:
+            while not self.stopped.wait(self.period):
+                self.check()
+                if not self.processes:
+                    raise RuntimeError(SHARDS_STOPPED_ERROR)
+        finally:
+            self.terminate()
+
+    def terminate(self):
+        """Остановка шардов с ожиданием их завершения."""
+        self.stopped.set()
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            process.join(SHUTDOWN_TIMEOUT)
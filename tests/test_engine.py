@@ -0,0 +1,1526 @@
+import asyncio
+import json
+import socket
+import sqlite3
+import threading
+import time
+from functools import partial
+
+import requests
+
+
+class MockBot:
+
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, chat_id=None, text=None, **kwargs):
+        self.messages.append((chat_id, text))
+
+
+class MockResponse:
+
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+        self.headers = {}
+
+    def json(self):
+        return self.data
+
+    def iter_content(self, chunk_size=1):
+        body = json.dumps(self.data).encode()
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class SimpleSession:
+
+    def get(self, url, headers=None, params=None, **kwargs):
+        return MockResponse({'homeworks': [], 'current_date': 1})
+
+
+def record_start(path, shard, shards):
+    with open(path, 'a') as file:
+        file.write(f'{shard}\n')
+
+
+def make_homework(status, name='hw', homework_id=1):
+    return {'id': homework_id, 'homework_name': name, 'status': status}
+
+
+class TestEngine:
+
+    def test_load_tenants_json(self, tmp_path):
+        import homework
+
+        path = tmp_path / 'tenants.json'
+        path.write_text(json.dumps([
+            {'practicum_token': 'a', 'chat_id': 1},
+            {'practicum_token': 'b', 'chat_id': 2},
+        ]))
+        tenants = homework.load_tenants(str(path))
+        assert [tenant.chat_id for tenant in tenants] == [1, 2], (
+            'Проверьте загрузку подписчиков из JSON-файла'
+        )
+        assert tenants[0].headers == {'Authorization': 'OAuth a'}, (
+            'Проверьте заголовки запроса подписчика'
+        )
+
+    def test_load_tenants_sqlite(self, tmp_path):
+        import homework
+
+        path = str(tmp_path / 'tenants.db')
+        with sqlite3.connect(path) as connection:
+            connection.execute(
+                'CREATE TABLE tenants (practicum_token TEXT, chat_id TEXT)'
+            )
+            connection.execute("INSERT INTO tenants VALUES ('a', '1')")
+        tenants = homework.load_tenants(path)
+        assert len(tenants) == 1 and tenants[0].practicum_token == 'a', (
+            'Проверьте загрузку подписчиков из базы SQLite'
+        )
+
+    def test_engine_polls_every_tenant(self, monkeypatch):
+        import homework
+
+        def mock_get(url, headers=None, params=None, **kwargs):
+            token = headers['Authorization'].split()[-1]
+            return MockResponse({
+                'homeworks': [make_homework('approved', name=token)],
+                'current_date': 100,
+            })
+
+        monkeypatch.setattr(requests, 'get', mock_get)
+        bot = MockBot()
+        tenants = [
+            homework.Tenant(str(number), number) for number in range(50)
+        ]
+        engine = homework.PollingEngine(
+            bot, tenants, workers=4, session=requests,
+            limiter=homework.AdaptiveRateLimiter(10 ** 6)
+        )
+        with homework.ThreadPoolExecutor(engine.workers) as executor:
+            engine.run_cycle(executor)
+        assert sorted(chat for chat, _ in bot.messages) == list(range(50)), (
+            'Каждый подписчик должен получить своё сообщение'
+        )
+        assert all(tenant.timestamp == 100 for tenant in tenants), (
+            'После опроса timestamp подписчика берётся из current_date'
+        )
+
+    def test_async_engine_caps_requests_in_flight(self):
+        import homework
+
+        in_flight = []
+        peak = []
+        threads = set()
+
+        class AsyncSession:
+
+            async def get(self, url, headers=None, params=None, **kwargs):
+                threads.add(threading.get_ident())
+                in_flight.append(1)
+                peak.append(len(in_flight))
+                await asyncio.sleep(0.01)
+                in_flight.pop()
+                return MockResponse({
+                    'homeworks': [make_homework('reviewing')],
+                    'current_date': 100,
+                })
+
+        bot = MockBot()
+        tenants = [
+            homework.Tenant(f'token{number}', number) for number in range(40)
+        ]
+        engine = homework.AsyncPollingEngine(
+            bot, tenants, concurrency=5, session=AsyncSession()
+        )
+
+        async def run_cycle():
+            engine.semaphore = asyncio.Semaphore(engine.workers)
+            with homework.ThreadPoolExecutor(4) as engine.executor:
+                await engine.run_cycle_async()
+
+        asyncio.run(run_cycle())
+        assert max(peak) == 5, (
+            'Число одновременных запросов к API не должно превышать лимит'
+        )
+        assert threads == {threading.get_ident()}, (
+            'Запросы к API должны выполняться в цикле событий, а не в потоках'
+        )
+        assert sorted(chat for chat, _ in bot.messages) == list(range(40)), (
+            'Каждый подписчик должен получить своё сообщение'
+        )
+        assert {text for _, text in bot.messages} == {
+            homework.parse_status(make_homework('reviewing'))
+        }, 'Подписчики должны получить сообщения о статусе работы'
+
+    def test_async_engine_closes_recorded_session(
+            self, monkeypatch, tmp_path):
+        import homework
+
+        closed = []
+
+        class ClosingSession(homework.AsyncSession):
+
+            async def get(self, url, headers=None, params=None, **kwargs):
+                return MockResponse({'homeworks': [], 'current_date': 100})
+
+            async def close(self):
+                closed.append(True)
+
+        monkeypatch.setattr(homework, 'CLOCK', homework.SimulatedClock(1000))
+        recorder = homework.Recorder(str(tmp_path / 'traffic.jsonl.gz'))
+        engine = homework.AsyncPollingEngine(
+            MockBot(), [homework.Tenant('token', 1)],
+            session=homework.AsyncRecordingSession(ClosingSession(), recorder)
+        )
+        engine.run_forever(until=1001)
+        recorder.close()
+        assert closed == [True], (
+            'Клиент aiohttp закрывается и при записи трафика'
+        )
+
+    def test_poll_interval(self, monkeypatch):
+        import homework
+
+        monkeypatch.setattr(homework, 'NIGHT_HOURS', range(0))
+        now = 10 ** 9
+        day = homework.IDLE_PERIOD
+        assert homework.poll_interval('reviewing', now, now) == (
+            homework.RETRY_TIME_MIN
+        ), 'Работу на проверке нужно опрашивать чаще всего'
+        assert homework.poll_interval('reviewing', now - 2 * day, now) == (
+            4 * homework.RETRY_TIME_MIN
+        ), 'Пауза затянувшейся проверки тоже удваивается за сутки'
+        assert homework.poll_interval(None, now, now) == (
+            homework.RETRY_TIME
+        ), 'Без истории подписчик опрашивается раз в RETRY_TIME'
+        assert homework.poll_interval(None, now - day, now) == (
+            2 * homework.RETRY_TIME
+        ), 'За сутки без изменений пауза удваивается'
+        assert homework.poll_interval('approved', now - 30 * day, now) == (
+            homework.RETRY_TIME_MAX
+        ), 'Пауза не должна превышать RETRY_TIME_MAX'
+
+    def test_scheduler_staggers_and_reschedules(self):
+        import homework
+
+        tenants = [
+            homework.Tenant(str(number), number) for number in range(4)
+        ]
+        engine = homework.PollingEngine(MockBot(), tenants, session=requests)
+        first = tenants[0].next_poll
+        offsets = [tenant.next_poll - first for tenant in tenants]
+        step = homework.RETRY_TIME / 4
+        assert [round(offset) for offset in offsets] == [
+            round(step * number) for number in range(4)
+        ], 'Первые опросы должны равномерно распределяться по интервалу'
+        assert engine.due() == tenants[:1], (
+            'Опрашивать нужно только подписчиков, чей срок наступил'
+        )
+        engine.scheduler.push(tenants[3], 0)
+        assert engine.due() == tenants[3:], (
+            'Перенесённый опрос должен извлекаться по новому сроку'
+        )
+        engine.scheduler.reschedule(tenants[3], 100, 0)
+        assert 90 <= tenants[3].next_poll <= 110, (
+            'Разброс интервала не должен превышать SCHEDULE_JITTER'
+        )
+
+    def test_same_token_tenants_share_one_request(self, monkeypatch):
+        import homework
+
+        calls = []
+
+        def mock_get(url, headers=None, params=None, **kwargs):
+            calls.append(params)
+            time.sleep(0.05)
+            return MockResponse({
+                'homeworks': [make_homework('approved')],
+                'current_date': 100,
+            })
+
+        monkeypatch.setattr(requests, 'get', mock_get)
+        bot = MockBot()
+        tenants = [homework.Tenant('token', number) for number in range(10)]
+        engine = homework.PollingEngine(
+            bot, tenants, workers=10, session=requests
+        )
+        assert len({tenant.next_poll for tenant in tenants}) == 1, (
+            'Чаты одного токена должны опрашиваться в одном слоте'
+        )
+        with homework.ThreadPoolExecutor(engine.workers) as executor:
+            engine.run_cycle(executor)
+        assert len(calls) == 1, (
+            'Одинаковые запросы к API должны объединяться в один'
+        )
+        assert len(bot.messages) == 10, (
+            'Результат запроса должен доставляться всем чатам токена'
+        )
+        assert engine.flights.hit_ratio() == 0.9
+
+    def test_state_store_survives_restart(self, monkeypatch, tmp_path):
+        import homework
+
+        def mock_get(url, headers=None, params=None, **kwargs):
+            return MockResponse({
+                'homeworks': [make_homework('approved')],
+                'current_date': 100,
+            })
+
+        monkeypatch.setattr(requests, 'get', mock_get)
+        path = str(tmp_path / 'state.db')
+        bot = MockBot()
+        tenant = homework.Tenant('token', 1)
+        engine = homework.PollingEngine(
+            bot, [tenant], session=requests, store=homework.StateStore(path)
+        )
+        engine.poll(tenant)
+        engine.save([tenant])
+        engine.store.close()
+
+        restored = homework.Tenant('token', 1)
+        engine = homework.PollingEngine(
+            bot, [restored], session=requests,
+            store=homework.StateStore(path)
+        )
+        assert restored.timestamp == 100, (
+            'После перезапуска timestamp берётся из хранилища'
+        )
+        assert restored.statuses == {'1': 'approved'}, (
+            'После перезапуска статусы работ берутся из хранилища'
+        )
+        engine.poll(restored)
+        assert len(bot.messages) == 1, (
+            'Доставленное сообщение не должно отправляться повторно'
+        )
+
+    def test_diff_homeworks_emits_only_transitions(self, monkeypatch):
+        import homework
+
+        responses = [
+            [
+                make_homework('reviewing', 'third', 3),
+                make_homework('approved', 'second', 2),
+                make_homework('rejected', 'first', 1),
+            ],
+            [
+                make_homework('approved', 'third', 3),
+                make_homework('approved', 'second', 2),
+            ],
+        ]
+
+        def mock_get(url, headers=None, params=None, **kwargs):
+            return MockResponse({
+                'homeworks': responses.pop(0), 'current_date': 100
+            })
+
+        monkeypatch.setattr(requests, 'get', mock_get)
+        bot = MockBot()
+        tenant = homework.Tenant('token', 1)
+        engine = homework.PollingEngine(bot, [tenant], session=requests)
+        engine.poll(tenant)
+        assert [text.split('"')[1] for _, text in bot.messages] == [
+            'first', 'second', 'third'
+        ], 'Сообщение отправляется по каждой работе в порядке изменений'
+        engine.poll(tenant)
+        assert len(bot.messages) == 4, (
+            'Отправляются только работы, статус которых изменился'
+        )
+        assert tenant.statuses == {
+            '1': 'rejected', '2': 'approved', '3': 'approved'
+        }, 'Индекс статусов должен обновляться по всем работам'
+
+    def test_outbox_limits_each_chat_separately(self):
+        import homework
+
+        bot = MockBot()
+        outbox = homework.Outbox(bot, global_rate=1000, chat_rate=20)
+        outbox.start()
+        for number in range(3):
+            outbox.put('busy', str(number))
+        outbox.put('quiet', 'quiet')
+        outbox.stop(timeout=5)
+        assert len(bot.messages) == 4, (
+            'Все сообщения из очереди должны быть отправлены'
+        )
+        assert bot.messages.index(('quiet', 'quiet')) == 1, (
+            'Лимит одного чата не должен задерживать другие чаты'
+        )
+
+    def test_outbox_honours_retry_after(self):
+        import homework
+
+        class ThrottledBot(MockBot):
+
+            def send_message(self, chat_id=None, text=None, **kwargs):
+                if not self.messages and not hasattr(self, 'throttled'):
+                    self.throttled = True
+                    raise homework.telegram.error.RetryAfter(0.05)
+                super().send_message(chat_id, text)
+
+        bot = ThrottledBot()
+        sent = []
+        outbox = homework.Outbox(bot, chat_rate=100)
+        outbox.start()
+        outbox.put(1, 'text', lambda: sent.append(True))
+        outbox.stop(timeout=5)
+        assert bot.messages == [(1, 'text')] and sent, (
+            'После RetryAfter сообщение должно быть отправлено повторно'
+        )
+
+    def test_transient_errors_are_retried(self, monkeypatch):
+        import homework
+
+        monkeypatch.setattr(homework, 'backoff_delay', lambda attempt: 0)
+        results = [ConnectionError('blip'), ConnectionError('blip'), 'ok']
+
+        def request():
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        breaker = homework.CircuitBreaker()
+        assert homework.call_with_retries(request, breaker) == 'ok', (
+            'Временная ошибка API должна повторяться'
+        )
+        assert breaker.stats()['retries'] == 2, (
+            'Проверьте подсчёт повторов запросов'
+        )
+
+    def test_permanent_errors_are_not_retried(self, monkeypatch):
+        import homework
+
+        calls = []
+
+        def request():
+            calls.append(1)
+            raise homework.APIStatusError('unauthorized', 401)
+
+        try:
+            homework.call_with_retries(request, homework.CircuitBreaker())
+        except homework.APIStatusError:
+            pass
+        assert len(calls) == 1, 'Постоянная ошибка API не повторяется'
+
+    def test_throttling_is_typed_and_slows_the_limiter(self, monkeypatch):
+        import homework
+
+        def mock_get(url, headers=None, params=None, **kwargs):
+            response = MockResponse({}, status_code=429)
+            response.headers = {'Retry-After': '3600'}
+            return response
+
+        monkeypatch.setattr(requests, 'get', mock_get)
+        limiter = homework.AdaptiveRateLimiter(rate=10, min_rate=1)
+        try:
+            homework.call_with_retries(
+                partial(homework.request_api, 0, {}),
+                homework.CircuitBreaker(threshold=1), limiter
+            )
+        except homework.ThrottledError as error:
+            assert error.retry_after == 3600, 'Проверьте разбор Retry-After'
+        else:
+            assert False, 'Код 429 должен приводить к ThrottledError'
+        assert limiter.rate == 5, 'Ограничение API снижает лимит запросов'
+        pause = limiter.paused_until - time.monotonic()
+        assert homework.RETRY_AFTER_MAX - 10 < pause, (
+            'Запросы приостанавливаются на время из Retry-After'
+        )
+        assert pause <= homework.RETRY_AFTER_MAX, (
+            'Пауза из Retry-After ограничена RETRY_AFTER_MAX'
+        )
+        for _ in range(200):
+            limiter.succeed()
+        assert limiter.rate == 10, 'Лимит восстанавливается до исходного'
+
+    def test_parse_retry_after(self):
+        import homework
+
+        assert homework.parse_retry_after('30') == 30
+        assert homework.parse_retry_after(None) is None
+        assert homework.parse_retry_after(
+            'Wed, 21 Oct 2015 07:28:00 GMT'
+        ) == 0, 'Прошедшая дата в Retry-After означает нулевую паузу'
+
+    def test_circuit_breaker_opens_and_recovers(self, monkeypatch):
+        import homework
+
+        def failing():
+            raise ConnectionError('down')
+
+        breaker = homework.CircuitBreaker(
+            threshold=2, recovery_time=0.05, probes=1
+        )
+        for _ in range(2):
+            try:
+                breaker.call(failing)
+            except ConnectionError:
+                pass
+        assert breaker.state == breaker.OPEN, (
+            'Предохранитель размыкается после серии ошибок'
+        )
+        try:
+            breaker.call(lambda: 'ok')
+        except homework.CircuitOpenError:
+            pass
+        else:
+            assert False, 'Разомкнутый предохранитель отклоняет запросы'
+        time.sleep(0.06)
+        assert breaker.call(lambda: 'ok') == 'ok'
+        assert breaker.state == breaker.CLOSED, (
+            'Успешный пробный запрос замыкает предохранитель'
+        )
+
+    def test_circuit_breaker_counts_only_probes(self):
+        import homework
+
+        breaker = homework.CircuitBreaker(
+            threshold=1, recovery_time=0, probes=3
+        )
+        assert breaker.before_call() is False, (
+            'Запрос замкнутого предохранителя не считается пробным'
+        )
+        breaker.record(False)
+        probes = [breaker.before_call() for _ in range(3)]
+        assert probes == [True] * 3, 'Пропускаются probes пробных запросов'
+        for probe in probes:
+            breaker.record(False, probe)
+        assert breaker.probes_in_flight == 0, (
+            'Завершившиеся пробные запросы не должны занимать места, '
+            'даже если предохранитель уже разомкнул другой запрос'
+        )
+        probes = [breaker.before_call() for _ in range(3)]
+        assert probes == [True] * 3, (
+            'Следующее восстановление снова пропускает все пробные запросы'
+        )
+
+    def test_request_to_silent_server_times_out(self, monkeypatch):
+        import homework
+
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen()
+        host, port = server.getsockname()
+        monkeypatch.setattr(
+            homework, 'ENDPOINT', f'http://{host}:{port}/homework_statuses/'
+        )
+        monkeypatch.setattr(homework, 'API_TIMEOUT', (0.2, 0.2))
+        started = time.monotonic()
+        try:
+            homework.request_api(0, {'Authorization': 'OAuth token'})
+        except ConnectionError:
+            pass
+        else:
+            assert False, 'Зависший запрос должен завершаться ошибкой'
+        finally:
+            server.close()
+        assert time.monotonic() - started < 2, (
+            'Запрос к API должен ограничиваться таймаутом'
+        )
+
+    def test_streamed_error_response_returns_connection(self, monkeypatch):
+        import homework
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class ErrorHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                body = b'{}'
+                self.send_response(500)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), ErrorHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address
+        monkeypatch.setattr(
+            homework, 'ENDPOINT', f'http://{host}:{port}/homework_statuses/'
+        )
+        monkeypatch.setattr(homework, 'POOL_TIMEOUT', 0.5)
+        session = homework.make_session(2)
+        errors = []
+        try:
+            for _ in range(4):
+                try:
+                    list(homework.stream_api(
+                        0, {'Authorization': 'OAuth token'}, {}, session
+                    ))
+                except Exception as error:
+                    errors.append(type(error))
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert errors == [homework.ServerError] * 4, (
+            'Ответ с ошибкой должен возвращать соединение в пул'
+        )
+
+    def test_async_request_to_silent_server_times_out(self, monkeypatch):
+        import homework
+
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen()
+        host, port = server.getsockname()
+        monkeypatch.setattr(
+            homework, 'ENDPOINT', f'http://{host}:{port}/homework_statuses/'
+        )
+        monkeypatch.setattr(homework, 'API_TIMEOUT', (0.2, 0.2))
+
+        async def request():
+            client = homework.AsyncSession()
+            try:
+                await homework.request_api_async(
+                    0, {'Authorization': 'OAuth token'}, client
+                )
+            finally:
+                await client.close()
+
+        started = time.monotonic()
+        try:
+            asyncio.run(request())
+        except ConnectionError:
+            pass
+        else:
+            assert False, 'Зависший запрос должен завершаться ошибкой'
+        finally:
+            server.close()
+        assert time.monotonic() - started < 2, (
+            'Асинхронный запрос к API должен ограничиваться таймаутом'
+        )
+
+    def test_cycle_deadline_cancels_pending_polls(self):
+        import homework
+
+        release = threading.Event()
+        tenants = [homework.Tenant('token', number) for number in range(3)]
+        engine = homework.PollingEngine(
+            MockBot(), tenants, workers=1, session=requests, deadline=0.1
+        )
+        engine.poll = lambda tenant: release.wait(5)
+        executor = homework.ThreadPoolExecutor(1)
+        engine.run_cycle(executor)
+        release.set()
+        executor.shutdown()
+        assert all(
+            tenant.next_poll <= time.time() for tenant in tenants[1:]
+        ), 'Не начатые до срока опросы отменяются и остаются в очереди'
+
+    def test_watchdog_detects_stalled_loop(self):
+        import homework
+
+        stalls = []
+        watchdog = homework.Watchdog(on_stall=lambda: stalls.append(1))
+        watchdog.beat(60)
+        assert not watchdog.check(), 'Живой цикл не считается зависшим'
+        watchdog.alive_until = time.monotonic() - 1
+        assert watchdog.check() and stalls, (
+            'Сторож должен обнаружить зависший цикл'
+        )
+
+    def test_metrics_endpoint(self):
+        import homework
+        import metrics
+
+        histogram = metrics.Histogram('test_seconds', 'test', (0.1, 1))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value)
+        assert list(histogram.samples()) == [
+            'test_seconds_bucket{le="0.1"} 1',
+            'test_seconds_bucket{le="1"} 2',
+            'test_seconds_bucket{le="+Inf"} 3',
+            'test_seconds_sum 5.55',
+            'test_seconds_count 3',
+        ], 'Проверьте формат гистограммы Prometheus'
+
+        homework.METRICS.errors.inc('ConnectionError')
+        server = metrics.start_metrics_server(0, homework.METRICS)
+        host, port = server.server_address
+        try:
+            body = requests.get(f'http://127.0.0.1:{port}/metrics').text
+        finally:
+            server.shutdown()
+        assert 'homework_poll_errors_total{type="ConnectionError"}' in body, (
+            'Счётчик ошибок должен отдаваться по HTTP'
+        )
+        assert '# TYPE homework_api_request_seconds histogram' in body
+
+    def test_token_is_not_leaked_in_errors(self, monkeypatch):
+        import homework
+
+        def mock_get(*args, **kwargs):
+            raise requests.exceptions.ConnectionError('refused')
+
+        monkeypatch.setattr(requests, 'get', mock_get)
+        try:
+            homework.request_api(0, {'Authorization': 'OAuth secret-token'})
+        except ConnectionError as error:
+            assert 'secret-token' not in str(error), (
+                'Токен Практикума не должен попадать в текст ошибки'
+            )
+        assert homework.redact(
+            'https://api.telegram.org/bot123:abc-DEF/sendMessage'
+        ) == 'https://api.telegram.org/bot***/sendMessage'
+
+    def test_repeated_tracebacks_are_rate_limited(self):
+        import logging
+
+        import log_pipeline
+
+        log_filter = log_pipeline.TracebackRateFilter(window=60)
+
+        def record():
+            try:
+                raise ConnectionError('down')
+            except ConnectionError as error:
+                return logging.LogRecord(
+                    'test', logging.ERROR, __file__, 1, 'fail', None,
+                    (type(error), error, error.__traceback__)
+                )
+
+        first, second = record(), record()
+        assert log_filter.filter(first) and first.exc_info, (
+            'Первая трассировка ошибки пишется в лог'
+        )
+        assert log_filter.filter(second) and not second.exc_info, (
+            'Повторная трассировка той же ошибки не пишется в лог'
+        )
+
+    def test_tracebacks_differing_in_numbers_are_rate_limited(self):
+        import logging
+
+        import homework
+        import log_pipeline
+
+        log_filter = log_pipeline.TracebackRateFilter(window=60)
+
+        def record(timestamp, address):
+            error = ConnectionError(homework.CONNECTION_ERROR.format(
+                error=f'<urllib3.connection.HTTPSConnection at {address}>',
+                enpoint=homework.ENDPOINT,
+                header={'Authorization': 'OAuth ***'},
+                params={'from_date': timestamp}
+            ))
+            return logging.LogRecord(
+                'test', logging.ERROR, __file__, 1, 'fail', None,
+                (type(error), error, None)
+            )
+
+        first = record(1700000000, '0x7f3a2b1c90d0')
+        second = record(1700000600, '0x7f3a2b1cafe0')
+        assert log_filter.filter(first) and first.exc_info, (
+            'Первая трассировка ошибки пишется в лог'
+        )
+        assert log_filter.filter(second) and not second.exc_info, (
+            'Ошибки, отличающиеся только from_date и адресами объектов, '
+            'считаются одной ошибкой'
+        )
+
+    def test_error_aggregation(self):
+        import homework
+
+        aggregator = homework.ErrorAggregator(window=60)
+        first = aggregator.record(ConnectionError('port 8001'), 0)
+        assert first and 'port 8001' in first, (
+            'Первая ошибка должна отправляться полностью'
+        )
+        assert aggregator.record(ConnectionError('port 8002'), 10) is None, (
+            'Повтор ошибки в пределах окна не должен отправляться'
+        )
+        assert aggregator.record(ValueError('x'), 20), (
+            'Ошибка другого вида должна отправляться сразу'
+        )
+        summary = aggregator.record(ConnectionError('port 8003'), 70)
+        assert summary and '×2' in summary, (
+            'По истечении окна должна отправляться сводка повторов'
+        )
+        assert aggregator.record(ValueError('x'), 200), (
+            'Ошибка, не повторявшаяся дольше окна, считается новой'
+        )
+        recovery = aggregator.recover()
+        assert 'ConnectionError ×3' in recovery, (
+            'Сообщение о восстановлении должно перечислять ошибки'
+        )
+        assert aggregator.recover() is None, (
+            'Сообщение о восстановлении отправляется один раз'
+        )
+
+    def test_error_aggregation_engine(self, monkeypatch, tmp_path):
+        import homework
+
+        bot = MockBot()
+        tenant = homework.Tenant('token', 'chat')
+        store = homework.StateStore(str(tmp_path / 'state.db'))
+        engine = homework.PollingEngine(
+            bot, [tenant], session=requests, store=store,
+            limiter=homework.AdaptiveRateLimiter(10 ** 6)
+        )
+        monkeypatch.setattr(
+            requests, 'get', lambda *args, **kwargs: MockResponse({}, 400)
+        )
+        for _ in range(3):
+            engine.poll(tenant)
+        engine.save([tenant])
+        assert len(bot.messages) == 1, (
+            'Повторы ошибки не должны отправляться подписчику'
+        )
+        restored = homework.Tenant('token', 'chat')
+        homework.StateStore(str(tmp_path / 'state.db')).load([restored])
+        monkeypatch.setattr(
+            requests, 'get',
+            lambda *args, **kwargs: MockResponse(
+                {'homeworks': [], 'current_date': 1}
+            )
+        )
+        engine.tenants = [restored]
+        engine.poll(restored)
+        assert 'восстановлена' in bot.messages[-1][1], (
+            'После ошибок должно отправляться сообщение о восстановлении'
+        )
+
+    def test_command_server(self, monkeypatch):
+        import homework
+        from types import SimpleNamespace
+
+        def mock_get(url, headers=None, params=None, **kwargs):
+            calls.append(url)
+            return MockResponse({
+                'homeworks': [make_homework('reviewing', 'hw.zip')],
+                'current_date': 100,
+            })
+
+        calls = []
+        monkeypatch.setattr(requests, 'get', mock_get)
+        bot = MockBot()
+        tenant = homework.Tenant('token', 1)
+        engine = homework.PollingEngine(bot, [tenant], session=requests)
+        engine.poll(tenant)
+        updates = [
+            SimpleNamespace(update_id=update_id, message=SimpleNamespace(
+                chat_id=chat_id, text=text
+            ))
+            for update_id, chat_id, text in (
+                (1, 1, '/status'), (2, 1, '/history@bot'), (3, 1, '/next'),
+                (4, 2, '/status'), (5, 1, '/start'),
+            )
+        ]
+        bot.get_updates = lambda **kwargs: updates
+        bot.messages.clear()
+        server = homework.CommandServer(bot, [tenant])
+        server.receive()
+        texts = [text for _, text in bot.messages]
+        assert len(calls) == 1, 'Команды не должны вызывать запрос к API'
+        assert server.offset == 6, 'Проверьте смещение getUpdates'
+        assert 'hw.zip' in texts[0] and 'ревьюером' in texts[0], (
+            '/status должен отвечать последним известным статусом'
+        )
+        assert 'hw.zip' in texts[1], '/history должен перечислять изменения'
+        assert 'мин' in texts[2], '/next должен сообщать время опроса'
+        assert texts[3] == homework.COMMAND_NOT_SUBSCRIBED, (
+            'Чату без подписки должно приходить предупреждение'
+        )
+        assert texts[4] == homework.COMMAND_HELP, (
+            'На неизвестную команду должна приходить справка'
+        )
+
+    def test_command_server_survives_failing_command(self):
+        import homework
+        from types import SimpleNamespace
+
+        bot = MockBot()
+        tenant = homework.Tenant('token', 1)
+        updates = [
+            SimpleNamespace(update_id=update_id, message=SimpleNamespace(
+                chat_id=1, text=text
+            ))
+            for update_id, text in ((1, '   '), (2, '/next'), (3, '/status'))
+        ]
+        bot.get_updates = lambda **kwargs: updates
+        server = homework.CommandServer(bot, [tenant])
+
+        def failing(tenant, now):
+            raise RuntimeError('сбой команды')
+
+        server.commands['/next'] = failing
+        server.receive()
+        texts = [text for _, text in bot.messages]
+        assert texts[0] == homework.COMMAND_HELP, (
+            'На сообщение из пробелов должна приходить справка'
+        )
+        assert server.offset == 4, (
+            'Ошибка обработки команды не должна прерывать пачку обновлений'
+        )
+        assert texts[1:] == [homework.COMMAND_STATUS_EMPTY], (
+            'Команды после упавшей должны обрабатываться'
+        )
+
+    def test_command_replies_share_chat_limit(self, monkeypatch):
+        import homework
+        from types import SimpleNamespace
+
+        clock = homework.SimulatedClock(1000)
+        monkeypatch.setattr(homework, 'CLOCK', clock)
+        bot = MockBot()
+        outbox = homework.Outbox(bot, chat_rate=1)
+        updates = [
+            SimpleNamespace(update_id=update_id, message=SimpleNamespace(
+                chat_id=1, text='/status'
+            ))
+            for update_id in range(3)
+        ]
+        bot.get_updates = lambda **kwargs: updates
+        server = homework.CommandServer(
+            bot, [homework.Tenant('token', '1')], outbox.global_bucket,
+            chat_bucket=outbox.chat_bucket
+        )
+        server.receive()
+        assert len(bot.messages) == 3, 'На каждую команду нужен ответ'
+        assert clock.monotonic() >= 1002, (
+            'Ответы на команды соблюдают лимит сообщений в чат'
+        )
+        assert outbox.chat_bucket('1').delay() > 0, (
+            'Ответы расходуют жетоны того же чата, что и очередь сообщений'
+        )
+
+    def test_command_server_answers_for_other_shard(
+            self, monkeypatch, tmp_path):
+        import homework
+
+        def mock_get(url, headers=None, params=None, **kwargs):
+            return MockResponse({
+                'homeworks': [make_homework('reviewing', 'hw.zip')],
+                'current_date': 100,
+            })
+
+        monkeypatch.setattr(requests, 'get', mock_get)
+        path = str(tmp_path / 'state.db')
+        polled = homework.Tenant('token', 1)
+        engine = homework.PollingEngine(
+            MockBot(), [polled], session=requests,
+            store=homework.StateStore(path)
+        )
+        engine.poll(polled)
+        engine.save([polled])
+        remote = homework.Tenant('token', 1)
+        server = homework.CommandServer(
+            MockBot(), [remote], store=homework.StateStore(path),
+            remote=[remote]
+        )
+        now = homework.CLOCK.time()
+        assert 'hw.zip' in server.answer(1, '/status', now), (
+            '/status должен показывать название работы с другого шарда'
+        )
+        assert 'hw.zip' in server.answer(1, '/history', now), (
+            '/history должен показывать изменения, сохранённые другим шардом'
+        )
+        assert server.answer(1, '/next', now) != (
+            homework.COMMAND_NEXT_UNKNOWN
+        ), '/next должен знать время опроса, назначенное другим шардом'
+        assert remote.next_poll == polled.next_poll, (
+            'Время следующего опроса должно читаться из хранилища'
+        )
+
+    def test_edit_mode_updates_status_message(self, monkeypatch, tmp_path):
+        import homework
+        from types import SimpleNamespace
+
+        class EditingBot(MockBot):
+
+            def send_message(self, chat_id=None, text=None, **kwargs):
+                super().send_message(chat_id, text)
+                return SimpleNamespace(message_id=len(self.messages))
+
+            def edit_message_text(self, text=None, chat_id=None,
+                                  message_id=None, **kwargs):
+                self.edits.append((message_id, text))
+
+            def pin_chat_message(self, chat_id=None, message_id=None,
+                                 **kwargs):
+                self.pinned.append(message_id)
+
+        statuses = iter(['reviewing', 'rejected', 'reviewing', 'approved'])
+
+        def mock_get(url, headers=None, params=None, **kwargs):
+            homework_data = make_homework(next(statuses))
+            homework_data['date_updated'] = params['from_date']
+            return MockResponse({
+                'homeworks': [homework_data],
+                'current_date': params['from_date'] + 1,
+            })
+
+        monkeypatch.setattr(requests, 'get', mock_get)
+        bot = EditingBot()
+        bot.edits, bot.pinned = [], []
+        path = str(tmp_path / 'state.db')
+        tenant = homework.Tenant('token', 1)
+        outbox = homework.Outbox(bot, chat_rate=100)
+        outbox.start()
+        engine = homework.PollingEngine(
+            bot, [tenant], session=requests, outbox=outbox,
+            store=homework.StateStore(path), notify_mode='edit'
+        )
+        engine.poll(tenant)
+        outbox.stop(timeout=5)
+        engine.save([tenant])
+        restored = homework.Tenant('token', 1)
+        outbox = homework.Outbox(bot, chat_rate=100)
+        outbox.start()
+        engine = homework.PollingEngine(
+            bot, [restored], session=requests, outbox=outbox,
+            store=homework.StateStore(path), notify_mode='edit'
+        )
+        for _ in range(3):
+            engine.poll(restored)
+        outbox.stop(timeout=5)
+        assert bot.pinned == [1], (
+            'Сообщение со статусом закрепляется один раз на работу'
+        )
+        assert [message_id for message_id, _ in bot.edits] == [1, 1, 1], (
+            'Каждое изменение статуса должно править сохранённое сообщение'
+        )
+        assert [bot.edits[0][1], bot.edits[2][1]] == [
+            text for _, text in bot.messages[1:]
+        ], 'Закреплённое сообщение должно показывать текущий статус'
+        assert len(bot.messages) == 3, (
+            'Новым сообщением приходят только итоговые вердикты'
+        )
+        assert restored.message_ids == {'1': 1}, (
+            'После итогового вердикта сообщение работы продолжает правиться'
+        )
+
+    def test_outbox_digest(self):
+        import homework
+
+        bot = MockBot()
+        sent = []
+        outbox = homework.Outbox(bot, chat_rate=100)
+        outbox.start()
+        for number in range(3):
+            outbox.put(1, str(number), partial(sent.append, number),
+                       digest=0.05)
+        outbox.put(2, 'now')
+        time.sleep(0.3)
+        outbox.put(1, 'late', digest=60)
+        outbox.stop(timeout=5)
+        assert bot.messages[0] == (2, 'now'), (
+            'Сообщения без окна отправляются сразу'
+        )
+        assert len(bot.messages) == 3, (
+            'Изменения в пределах окна объединяются в одно сообщение'
+        )
+        assert all(text in bot.messages[1][1] for text in '012'), (
+            'Дайджест должен содержать все накопленные изменения'
+        )
+        assert sent == [0, 1, 2], (
+            'После отправки дайджеста доставка отмечается для каждого'
+        )
+        assert bot.messages[2] == (1, 'late'), (
+            'Накопленное сообщение отправляется при остановке очереди'
+        )
+
+    def test_durable_outbox_survives_failed_send(self, monkeypatch, tmp_path):
+        import homework
+
+        class BrokenBot(MockBot):
+
+            def send_message(self, chat_id=None, text=None, **kwargs):
+                raise homework.telegram.error.NetworkError('down')
+
+        def mock_get(url, headers=None, params=None, **kwargs):
+            return MockResponse({
+                'homeworks': [make_homework('approved')],
+                'current_date': 100,
+            })
+
+        monkeypatch.setattr(requests, 'get', mock_get)
+        monkeypatch.setattr(homework, 'backoff_delay', lambda attempt: 0)
+        path = str(tmp_path / 'state.db')
+
+        def run(bot):
+            tenant = homework.Tenant('token', 1)
+            outbox = homework.Outbox(bot, chat_rate=100)
+            outbox.start()
+            engine = homework.PollingEngine(
+                bot, [tenant], session=requests, outbox=outbox,
+                store=homework.StateStore(path)
+            )
+            engine.poll(tenant)
+            outbox.stop(timeout=5)
+            engine.save([tenant])
+
+        run(BrokenBot())
+        connection = sqlite3.connect(path)
+        count = 'SELECT COUNT(*) FROM outbox'
+        assert connection.execute(count).fetchone() == (1,), (
+            'Неотправленное сообщение должно остаться в outbox'
+        )
+        bot = MockBot()
+        run(bot)
+        run(bot)
+        assert len(bot.messages) == 1, (
+            'После перезапуска сообщение отправляется ровно один раз'
+        )
+        assert connection.execute(count).fetchone() == (0,), (
+            'Подтверждённое сообщение должно удаляться из outbox'
+        )
+
+    def test_outbox_redelivers_after_long_outage(self, monkeypatch, tmp_path):
+        import homework
+
+        class FlakyBot(MockBot):
+
+            def __init__(self, failures):
+                super().__init__()
+                self.failures = failures
+
+            def send_message(self, chat_id=None, text=None, **kwargs):
+                if self.failures:
+                    self.failures -= 1
+                    raise homework.telegram.error.NetworkError('down')
+                super().send_message(chat_id, text)
+
+        def mock_get(url, headers=None, params=None, **kwargs):
+            return MockResponse({
+                'homeworks': [make_homework('approved')],
+                'current_date': 100,
+            })
+
+        clock = homework.SimulatedClock(1000)
+        monkeypatch.setattr(homework, 'CLOCK', clock)
+        monkeypatch.setattr(requests, 'get', mock_get)
+        monkeypatch.setattr(homework, 'backoff_delay', lambda attempt: 0)
+        path = str(tmp_path / 'state.db')
+        bot = FlakyBot(homework.RETRY_ATTEMPTS + 1)
+        tenant = homework.Tenant('token', 1)
+        outbox = homework.Outbox(bot, chat_rate=100)
+        outbox.start()
+        engine = homework.PollingEngine(
+            bot, [tenant], session=requests, outbox=outbox,
+            store=homework.StateStore(path)
+        )
+        engine.poll(tenant)
+        started = time.monotonic()
+        while engine.pending and time.monotonic() - started < 5:
+            clock.sleep(1)
+            time.sleep(0.01)
+        assert not engine.pending and not bot.messages, (
+            'Сообщение, от отправки которого отказались, не должно '
+            'считаться ожидающим отправки'
+        )
+        engine.save([tenant])
+        clock.sleep(homework.REDELIVERY_TIME)
+        engine.save([tenant])
+        outbox.stop(timeout=5)
+        engine.save([tenant])
+        assert len(bot.messages) == 1, (
+            'После восстановления Telegram сообщение из outbox должно '
+            'отправляться без перезапуска'
+        )
+        count = sqlite3.connect(path).execute(
+            'SELECT COUNT(*) FROM outbox'
+        ).fetchone()
+        assert count == (0,), 'Доставленное сообщение удаляется из outbox'
+
+    def test_outbox_drops_message_on_permanent_error(
+            self, monkeypatch, tmp_path):
+        import homework
+
+        class BlockedBot(MockBot):
+
+            def send_message(self, chat_id=None, text=None, **kwargs):
+                self.messages.append((chat_id, text))
+                raise homework.telegram.error.Unauthorized('blocked')
+
+        def mock_get(url, headers=None, params=None, **kwargs):
+            return MockResponse({
+                'homeworks': [make_homework('approved')],
+                'current_date': 100,
+            })
+
+        clock = homework.SimulatedClock(1000)
+        monkeypatch.setattr(homework, 'CLOCK', clock)
+        monkeypatch.setattr(requests, 'get', mock_get)
+        path = str(tmp_path / 'state.db')
+        bot = BlockedBot()
+        tenant = homework.Tenant('token', 1)
+        outbox = homework.Outbox(bot, chat_rate=100)
+        outbox.start()
+        engine = homework.PollingEngine(
+            bot, [tenant], session=requests, outbox=outbox,
+            store=homework.StateStore(path)
+        )
+        engine.poll(tenant)
+        started = time.monotonic()
+        while engine.pending and time.monotonic() - started < 5:
+            time.sleep(0.01)
+        engine.save([tenant])
+        clock.sleep(homework.REDELIVERY_TIME)
+        engine.save([tenant])
+        outbox.stop(timeout=5)
+        assert len(bot.messages) == 1, (
+            'После постоянной ошибки Telegram сообщение не повторяется'
+        )
+        count = sqlite3.connect(path).execute(
+            'SELECT COUNT(*) FROM outbox'
+        ).fetchone()
+        assert count == (0,), (
+            'Сообщение, отвергнутое Telegram, удаляется из outbox'
+        )
+
+    def test_polling_pass_commits_once(self, monkeypatch, tmp_path):
+        import homework
+
+        def mock_get(url, headers=None, params=None, **kwargs):
+            return MockResponse({
+                'homeworks': [make_homework('approved')],
+                'current_date': 100,
+            })
+
+        clock = homework.SimulatedClock(1000)
+        monkeypatch.setattr(homework, 'CLOCK', clock)
+        monkeypatch.setattr(requests, 'get', mock_get)
+        path = str(tmp_path / 'state.db')
+        bot = MockBot()
+        tenants = [homework.Tenant('token', number) for number in range(5)]
+        engine = homework.PollingEngine(
+            bot, tenants, session=requests, store=homework.StateStore(path)
+        )
+        statements = []
+        engine.store.connection.set_trace_callback(statements.append)
+        engine.run_forever(until=1001)
+        assert len(bot.messages) == 5, 'Каждый чат должен получить сообщение'
+        assert statements.count('COMMIT') == 1, (
+            'Проход опроса должен записываться одной транзакцией'
+        )
+        count = sqlite3.connect(path).execute(
+            'SELECT COUNT(*) FROM outbox'
+        ).fetchone()
+        assert count == (5,), (
+            'Сообщения прохода записываются в outbox до отправки'
+        )
+
+    def test_hash_ring_moves_few_tenants(self):
+        import homework
+
+        tokens = [f'token-{number}' for number in range(3000)]
+        three, four = homework.HashRing(3), homework.HashRing(4)
+        owners = [three.owner(token) for token in tokens]
+        counts = [owners.count(shard) for shard in range(3)]
+        assert min(counts) > 600, 'Подписчики должны делиться равномерно'
+        moved = sum(
+            three.owner(token) != four.owner(token) for token in tokens
+        )
+        assert moved < len(tokens) * 0.35, (
+            'Новый шард должен забирать лишь небольшую долю подписчиков'
+        )
+        tenants = [homework.Tenant(token, 1) for token in tokens[:100]]
+        shards = [
+            homework.shard_tenants(tenants, shard, 3) for shard in range(3)
+        ]
+        assert sorted(
+            id(tenant) for shard in shards for tenant in shard
+        ) == sorted(map(id, tenants)), (
+            'Каждый подписчик должен принадлежать ровно одному шарду'
+        )
+
+    def test_supervisor_restarts_shard(self, tmp_path):
+        import shard_supervisor
+
+        path = str(tmp_path / 'starts')
+        supervisor = shard_supervisor.Supervisor(
+            2, partial(record_start, path)
+        )
+        for shard in range(2):
+            supervisor.spawn(shard)
+        for process in supervisor.processes.values():
+            process.join(5)
+        supervisor.check()
+        for process in supervisor.processes.values():
+            process.join(5)
+        supervisor.terminate()
+        with open(path) as file:
+            starts = sorted(file.read().split())
+        assert starts == ['0', '0', '1', '1'], (
+            'Завершившийся шард должен перезапускаться с тем же номером'
+        )
+
+    def test_supervisor_backs_off_and_gives_up(self, monkeypatch, tmp_path):
+        import shard_supervisor
+
+        monkeypatch.setattr(shard_supervisor, 'SHARD_RESTART_DELAY', 0.2)
+        monkeypatch.setattr(shard_supervisor, 'SHARD_RESTARTS', 3)
+        path = str(tmp_path / 'starts')
+        supervisor = shard_supervisor.Supervisor(
+            1, partial(record_start, path)
+        )
+        supervisor.spawn(0)
+        delays = []
+        started = time.monotonic()
+        while supervisor.processes and time.monotonic() - started < 10:
+            supervisor.processes[0].join(5)
+            restart_at = supervisor.restart_at.get(0)
+            supervisor.check()
+            if restart_at is None and 0 in supervisor.restart_at:
+                delays.append(
+                    round(supervisor.restart_at[0] - time.monotonic(), 1)
+                )
+            time.sleep(0.05)
+        with open(path) as file:
+            starts = file.read().split()
+        assert len(starts) == 1 + 3, (
+            'Шард перезапускается не больше SHARD_RESTARTS раз подряд'
+        )
+        assert delays == [0.2, 0.4], (
+            'Пауза перед повторным перезапуском должна удваиваться'
+        )
+        assert not supervisor.processes, (
+            'Брошенный шард не должен перезапускаться'
+        )
+
+    def test_shard_log_is_flushed_on_exit(self, monkeypatch, tmp_path):
+        import homework
+        import logging
+        import multiprocessing
+
+        def main(shard, shards):
+            for number in range(1000):
+                logging.error('запись шарда %s номер %s', shard, number)
+
+        monkeypatch.setattr(homework, 'LOG_FILE', str(tmp_path / 'bot.log'))
+        monkeypatch.setattr(homework, 'SHARD_LOCK_DIR', str(tmp_path))
+        monkeypatch.setattr(homework, 'main', main)
+        process = multiprocessing.Process(
+            target=homework.run_shard, args=(3, 4)
+        )
+        process.start()
+        process.join(10)
+        with open(tmp_path / 'bot.log.3', encoding='utf-8') as file:
+            assert 'запись шарда 3 номер 999' in file.read(), (
+                'Записи лога шарда должны дописываться до его завершения'
+            )
+
+    def test_streaming_homeworks(self):
+        import homework
+
+        data = {
+            'homeworks': [
+                make_homework('approved', 'новая', 2),
+                make_homework('reviewing', 'старая', 1),
+                make_homework('reviewing', 'новая', 2),
+            ],
+            'current_date': 1234567890,
+        }
+        body = json.dumps(data, ensure_ascii=False).encode()
+        fields = {}
+        chunks = (body[start:start + 5] for start in range(0, len(body), 5))
+        homeworks = homework.iter_homeworks(chunks, fields)
+        assert next(homeworks) == data['homeworks'][0], (
+            'Работы должны отдаваться до чтения ответа целиком'
+        )
+        assert list(homeworks) == data['homeworks'][1:], (
+            'Проверьте разбор работ из ответа, разбитого на части'
+        )
+        assert fields == {'homeworks': [], 'current_date': 1234567890}, (
+            'Остальные поля ответа должны сохраняться'
+        )
+        changes = homework.iter_changes({'1': 'reviewing'}, data['homeworks'])
+        assert list(changes) == [data['homeworks'][0]], (
+            'Для каждой работы учитывается только самая новая запись'
+        )
+        for head, tail in ((b'1.', b'5}'), (b'1e', b'3}'), (b'-', b'2}')):
+            fields = {}
+            list(homework.iter_homeworks(
+                [b'{"homeworks": [], "current_date": ' + head, tail], fields
+            ))
+            assert fields['current_date'] == json.loads(head + tail[:-1]), (
+                'Число, разбитое границей частей, должно читаться целиком'
+            )
+
+    def test_backfill_resumes_from_checkpoint(self, monkeypatch, tmp_path):
+        import homework
+
+        def mock_get(url, headers=None, params=None, **kwargs):
+            calls.append(headers['Authorization'])
+            if headers['Authorization'] in broken:
+                return MockResponse({}, 400)
+            return MockResponse({
+                'homeworks': [
+                    make_homework('approved', 'new', 2),
+                    make_homework('rejected', 'old', 1),
+                    make_homework('reviewing', 'old', 1),
+                ],
+                'current_date': 100,
+            })
+
+        calls, broken = [], {'OAuth c'}
+        monkeypatch.setattr(requests, 'get', mock_get)
+        path = str(tmp_path / 'state.db')
+
+        def run():
+            tenants = [
+                homework.Tenant('a', 1), homework.Tenant('a', 2),
+                homework.Tenant('b', 3), homework.Tenant('c', 4),
+            ]
+            loaded = homework.Backfill(
+                homework.StateStore(path), chunk=2, session=requests,
+                limiter=homework.AdaptiveRateLimiter(10 ** 6)
+            ).run(tenants)
+            return loaded, tenants
+
+        loaded, tenants = run()
+        assert loaded == 3 and sorted(calls) == [
+            'OAuth a', 'OAuth b', 'OAuth c'
+        ], (
+            'История токена загружается одним запросом для всех его чатов'
+        )
+        restored = homework.Tenant('a', 2)
+        homework.StateStore(path).load([restored])
+        assert restored.statuses == {'2': 'approved', '1': 'rejected'}, (
+            'В хранилище должны попасть последние статусы всех работ'
+        )
+        assert restored.timestamp == 100, (
+            'Опрос после загрузки должен продолжаться с current_date'
+        )
+        calls.clear()
+        broken.clear()
+        loaded, _ = run()
+        assert loaded == 1 and calls == ['OAuth c'], (
+            'Повторная загрузка должна продолжаться с незавершённых токенов'
+        )
+
+    def test_recorder_redacts_traffic(self, tmp_path):
+        import gzip
+        import homework
+
+        path = str(tmp_path / 'traffic.jsonl.gz')
+        recorder = homework.Recorder(path)
+        tenant = homework.Tenant('secret-token', 42)
+        recorder.tenants([tenant])
+        session = homework.RecordingSession(SimpleSession(), recorder)
+        bot = homework.RecordingBot(MockBot(), recorder)
+        session.get(
+            homework.ENDPOINT, headers=tenant.headers,
+            params={'from_date': 0}
+        )
+        bot.send_message(chat_id=42, text='OAuth secret-token')
+        recorder.close()
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            text = file.read()
+        events = [json.loads(line) for line in text.splitlines()]
+        assert [event['kind'] for event in events] == [
+            'tenants', 'api', 'telegram'
+        ], 'Журнал должен содержать подписчиков, ответы API и отправку'
+        assert 'secret-token' not in text, 'Токены не должны попадать в журнал'
+        assert events[1]['body'] == {'homeworks': [], 'current_date': 1}, (
+            'Ответ API должен записываться целиком'
+        )
+        assert events[1]['token'] == events[0]['tenants'][0][0], (
+            'Ответ должен сопоставляться с подписчиком по идентификатору'
+        )
+
+    def test_main_runs_week_on_simulated_clock(self, monkeypatch, tmp_path):
+        import signal
+
+        import homework
+
+        start = 1_600_000_000
+        clock = homework.SimulatedClock(start)
+        timeline = [
+            (start + 86400, 'reviewing'),
+            (start + 3 * 86400, 'rejected'),
+            (start + 5 * 86400, 'approved'),
+        ]
+        requested = []
+
+        class TimelineSession:
+
+            def get(self, url, headers=None, params=None, **kwargs):
+                requested.append(clock.time())
+                homeworks = [
+                    make_homework(status)
+                    for at, status in timeline if at <= clock.time()
+                ][-1:]
+                return MockResponse({
+                    'homeworks': homeworks,
+                    'current_date': int(clock.time()),
+                })
+
+        bot = MockBot()
+        path = str(tmp_path / 'state.db')
+        monkeypatch.setattr(homework, 'CLOCK', clock)
+        monkeypatch.setattr(homework.telegram, 'Bot', lambda **kwargs: bot)
+        monkeypatch.setattr(
+            homework, 'make_session', lambda *args: TimelineSession()
+        )
+        monkeypatch.setattr(signal, 'signal', lambda *args: None)
+        for name, value in [
+            ('PRACTICUM_TOKEN', 'token'), ('TELEGRAM_TOKEN', 'bot'),
+            ('TELEGRAM_CHAT_ID', 1), ('TENANTS_FILE', None),
+            ('STATE_DB', path), ('COMMANDS_POLL_TIMEOUT', 0),
+            ('METRICS_PORT', 0), ('RECORD_FILE', None),
+        ]:
+            monkeypatch.setattr(homework, name, value)
+        week = 7 * 86400
+        started = time.monotonic()
+        homework.main(until=start + week)
+        assert time.monotonic() - started < 10, (
+            'Неделя модельного времени должна проходить за секунды'
+        )
+        assert clock.time() >= start + week, (
+            'Цикл должен работать до момента until по модельным часам'
+        )
+        assert [text for chat, text in bot.messages] == [
+            homework.parse_status(make_homework(status))
+            for at, status in timeline
+        ], 'Каждая смена статуса должна отправляться один раз и по порядку'
+        assert len(requested) > 7, 'API должен опрашиваться всю неделю'
+        row = sqlite3.connect(path).execute(
+            'SELECT timestamp FROM state'
+        ).fetchone()
+        assert row[0] >= timeline[-1][0], (
+            'Состояние подписчика должно сохраняться при остановке'
+        )
+
+    def test_simulated_clock_runs_rate_limited_polls_inline(
+            self, monkeypatch):
+        import homework
+
+        clock = homework.SimulatedClock(1_700_000_000.0)
+        monkeypatch.setattr(homework, 'CLOCK', clock)
+        bucket = homework.TokenBucket(20)
+        threads = []
+
+        def acquire():
+            threads.append(threading.get_ident())
+            bucket.acquire()
+
+        def run():
+            with clock.executor(8) as executor:
+                homework.wait([executor.submit(acquire) for _ in range(100)])
+
+        worker = threading.Thread(target=run, daemon=True)
+        worker.start()
+        worker.join(5)
+        assert not worker.is_alive(), (
+            'Ожидание жетона на модельных часах должно завершаться'
+        )
+        assert set(threads) == {worker.ident}, (
+            'На модельных часах опросы выполняются в потоке цикла'
+        )
+        assert clock.time() >= 1_700_000_000 + 4, (
+            'Ожидание жетонов должно переводить модельные часы'
+        )